@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """Scoped answer cache with an exact tier and an optional semantic tier
+
+    The exact tier is keyed by (scope, normalized question, retrieved chunk IDs). The semantic
+    tier reuses an answer from the same scope when the question embedding has cosine similarity
+    of at least semantic_threshold and the retrieved chunk IDs overlap by at least
+    context_overlap (Jaccard). Scopes keep per-user answers apart; answers built only from the
+    shared corpus live in the "common" scope.
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 3600, semantic_enabled: bool = False,
+                 semantic_threshold: float = 0.95, context_overlap: float = 0.75,
+                 semantic_max_per_scope: int = 500):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_enabled = semantic_enabled
+        self.semantic_threshold = semantic_threshold
+        self.context_overlap = context_overlap
+        self.semantic_max_per_scope = semantic_max_per_scope
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # scope -> key -> (unit question vector, chunk id set)
+        self._semantic: Dict[str, "OrderedDict[Tuple, Tuple[np.ndarray, frozenset]]"] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(scope: str, question: str, chunk_ids: List[str]) -> Tuple:
+        return scope, normalize_text(question), tuple(chunk_ids)
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _get_fresh(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _remove(self, key: Tuple):
+        self._entries.pop(key, None)
+        scope_entries = self._semantic.get(key[0])
+        if scope_entries is not None:
+            scope_entries.pop(key, None)
+
+    def get(self, scope: str, question: str, chunk_ids: List[str],
+            query_vector: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+        key = self._key(scope, question, chunk_ids)
+        with self._lock:
+            result = self._get_fresh(key)
+            if result is not None:
+                self.exact_hits += 1
+                return result
+
+            if self.semantic_enabled and query_vector is not None and self._semantic.get(scope):
+                result = self._semantic_lookup(scope, self._unit(query_vector), frozenset(chunk_ids))
+                if result is not None:
+                    self.semantic_hits += 1
+                    return result
+
+            self.misses += 1
+            return None
+
+    def _semantic_lookup(self, scope: str, vector: np.ndarray, chunk_ids: frozenset) -> Optional[Dict[str, Any]]:
+        keys = list(self._semantic[scope].keys())
+        candidates = list(self._semantic[scope].values())
+        similarities = np.stack([candidate_vector for candidate_vector, _ in candidates]) @ vector
+        for index in np.argsort(-similarities):
+            if similarities[index] < self.semantic_threshold:
+                break
+            candidate_ids = candidates[index][1]
+            union = len(chunk_ids | candidate_ids)
+            if union and len(chunk_ids & candidate_ids) / union >= self.context_overlap:
+                result = self._get_fresh(keys[index])
+                if result is not None:
+                    return result
+        return None
+
+    def put(self, scope: str, question: str, chunk_ids: List[str], result: Dict[str, Any],
+            query_vector: Optional[List[float]] = None):
+        key = self._key(scope, question, chunk_ids)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            if self.semantic_enabled and query_vector is not None:
+                scope_entries = self._semantic.setdefault(scope, OrderedDict())
+                scope_entries[key] = (self._unit(query_vector), frozenset(chunk_ids))
+                while len(scope_entries) > self.semantic_max_per_scope:
+                    scope_entries.popitem(last=False)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._remove(oldest)
+
+    def invalidate_scope(self, scope: str):
+        """Drop every cached answer in a scope, e.g. after a user's documents change"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == scope]:
+                del self._entries[key]
+            self._semantic.pop(scope, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+            }
@@ -193,11 +193,15 @@ if (docElements.userName) {
                 formData.append('files', file);
             }
             const token = await fetchIdToken();
-            await fetch(`${BACKEND_URL}/upload`, {
+            const response = await fetch(`${BACKEND_URL}/upload`, {
                 method: 'POST',
                 headers: { 'Authorization': `Bearer ${token}` },
                 body: formData
             });
+            if (!response.ok) throw new Error(`Upload request failed: ${response.status}`);
+            const data = await response.json();
+            const job = await waitForUploadJob(data.job_id);
+            if (job.stage === 'failed') throw new Error(job.error);
             listDocuments();
         } catch (error) {
             console.error('Error uploading files:', error);
@@ -205,6 +209,19 @@ if (docElements.userName) {
         }
     }
 
+    async function waitForUploadJob(jobId) {
+        while (true) {
+            const token = await fetchIdToken();
+            const response = await fetch(`${BACKEND_URL}/upload/jobs/${jobId}`, {
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+            if (!response.ok) throw new Error(`Upload status request failed: ${response.status}`);
+            const job = await response.json();
+            if (job.stage === 'completed' || job.stage === 'failed') return job;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
     async function clearDocuments() {
         try {
             const token = await fetchIdToken();
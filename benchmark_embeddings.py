@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark the embedding backends against the sentence-transformers (torch) model.
+
+parity:     embeds a corpus with the torch model and a candidate backend, reports per-text
+            cosine similarity and whether each query retrieves the same top-k chunks, and
+            exits non-zero if any cosine similarity falls below --tolerance.
+throughput: loads each backend, then reports load time, chunk embedding throughput and
+            single-question latency.
+server:     issues questions from concurrent coroutines (optionally alongside a bulk
+            ingestion stream), calling the model directly from threads and then through
+            the micro-batching EmbeddingServer, and reports question latency and throughput.
+
+Texts are generated chunk-sized passages unless --texts points at a file with one per line.
+
+Usage: python benchmark_embeddings.py parity --backend onnx --quantize --tolerance 0.98
+       python benchmark_embeddings.py throughput --threads 4
+       python benchmark_embeddings.py server --backend torch --concurrency 1 16 64 --ingest
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+from embedding_backends import create_embeddings
+from embedding_server import EmbeddingServer
+
+WORDS = ("court section act appeal petition order evidence contract tenant lease clause notice "
+         "liability damages employer statute tribunal judgment bail offence landlord deposit "
+         "wages termination consumer refund warranty property inheritance custody").split()
+
+
+def generate_texts(count: int, seed: int = 0) -> List[str]:
+    """Passages from a sentence to a full 1000-character chunk, like the splitter produces"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + "."
+                     for _ in range(rng.randint(1, 12))]
+        texts.append(" ".join(sentences)[:1000])
+    return texts
+
+
+def load_texts(args) -> Tuple[List[str], List[str]]:
+    if args.texts:
+        with open(args.texts) as f:
+            texts = [line.strip() for line in f if line.strip()][:args.count]
+    else:
+        texts = generate_texts(args.count)
+    queries = [f"What does the {a} say about {b} {c}?" for a, b, c in
+               (random.Random(i).sample(WORDS, 3) for i in range(args.queries))]
+    return texts, queries
+
+
+def build(backend: str, args, quantize: bool = False):
+    start = time.perf_counter()
+    embeddings, _ = create_embeddings(backend, args.model, threads=args.threads, batch_size=args.batch_size,
+                                      max_batch_tokens=args.max_batch_tokens, onnx_file=args.onnx_file,
+                                      quantize=quantize)
+    return embeddings, time.perf_counter() - start
+
+
+def parity(args) -> int:
+    texts, queries = load_texts(args)
+    reference, _ = build("torch", args)
+    candidate, _ = build(args.backend, args, quantize=args.quantize)
+
+    expected = np.array(reference.embed_documents(texts))
+    actual = np.array(candidate.embed_documents(texts))
+    cosine = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    print(f"chunks: {len(texts)}  cosine min={cosine.min():.6f} mean={cosine.mean():.6f}  "
+          f"max abs diff={np.abs(expected - actual).max():.2e}")
+
+    expected_queries = np.array([reference.embed_query(q) for q in queries])
+    actual_queries = np.array([candidate.embed_query(q) for q in queries])
+    overlaps = []
+    for expected_query, actual_query in zip(expected_queries, actual_queries):
+        expected_top = set(np.argsort(-(expected @ expected_query))[:args.k])
+        actual_top = set(np.argsort(-(actual @ actual_query))[:args.k])
+        overlaps.append(len(expected_top & actual_top) / args.k)
+    print(f"queries: {len(queries)}  top-{args.k} overlap mean={statistics.mean(overlaps):.3f} "
+          f"min={min(overlaps):.3f}")
+
+    if cosine.min() < args.tolerance:
+        print(f"FAIL: cosine similarity {cosine.min():.6f} below tolerance {args.tolerance}")
+        return 1
+    print("OK")
+    return 0
+
+
+def throughput(args) -> int:
+    texts, queries = load_texts(args)
+    variants = [("torch", False), ("onnx", False), ("onnx", True)]
+    for backend, quantize in variants:
+        label = f"{backend}{' int8' if quantize else ''}"
+        try:
+            embeddings, load_seconds = build(backend, args, quantize=quantize)
+        except ImportError as e:
+            print(f"{label:<10} skipped: {e}")
+            continue
+        embeddings.embed_documents(texts[:args.batch_size])  # Warm up
+
+        start = time.perf_counter()
+        for i in range(0, len(texts), args.batch_size):
+            embeddings.embed_documents(texts[i:i + args.batch_size])
+        chunk_seconds = time.perf_counter() - start
+
+        latencies = []
+        for query in queries:
+            query_start = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append(time.perf_counter() - query_start)
+        latencies.sort()
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        print(f"{label:<10} load={load_seconds:6.2f}s  chunks={len(texts) / chunk_seconds:8.1f}/s  "
+              f"query p50={statistics.median(latencies) * 1000:6.2f}ms p95={p95 * 1000:6.2f}ms")
+    return 0
+
+
+async def _question_load(embed_query, queries: List[str], concurrency: int) -> Tuple[List[float], float]:
+    latencies: List[float] = []
+    pending = iter(queries)
+
+    async def client():
+        for query in pending:
+            start = time.perf_counter()
+            await embed_query(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return sorted(latencies), time.perf_counter() - start
+
+
+def server(args) -> int:
+    texts, queries = load_texts(args)
+    embeddings, _ = build(args.backend, args, quantize=args.quantize)
+    embeddings.embed_documents(texts[:args.batch_size])  # Warm up
+    batching = EmbeddingServer(embeddings, max_batch_size=args.batch_size, bulk_batch_size=args.bulk_batch_size,
+                               batch_window=args.batch_window_ms / 1000)
+
+    def ingest(target, stop: threading.Event):
+        # A steady upload: 64-chunk writes until the questions are done
+        while not stop.is_set():
+            for i in range(0, len(texts), 64):
+                if stop.is_set():
+                    break
+                target.embed_documents(texts[i:i + 64])
+
+    for concurrency in args.concurrency:
+        for label, target in [("direct", embeddings), ("server", batching)]:
+            stop = threading.Event()
+            ingester = threading.Thread(target=ingest, args=(target, stop), daemon=True) if args.ingest else None
+            if ingester:
+                ingester.start()
+            if target is batching:
+                embed_query = batching.aembed_query
+            else:
+                executor = ThreadPoolExecutor(max_workers=concurrency)
+                loop_embed = embeddings.embed_query
+
+                async def embed_query(query, executor=executor, loop_embed=loop_embed):
+                    return await asyncio.get_running_loop().run_in_executor(executor, loop_embed, query)
+            latencies, wall = asyncio.run(_question_load(embed_query, queries, concurrency))
+            stop.set()
+            if ingester:
+                ingester.join()
+            p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+            print(f"concurrency={concurrency:<4} {label:<7} questions={len(queries) / wall:8.1f}/s  "
+                  f"p50={statistics.median(latencies) * 1000:7.2f}ms p95={p95 * 1000:7.2f}ms")
+    print(f"server stats: {batching.stats()}")
+    batching.stop()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["parity", "throughput", "server"])
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="onnx",
+                        help="Backend checked by parity and used by server")
+    parser.add_argument("--quantize", action="store_true", help="Use the int8 onnx model in parity and server")
+    parser.add_argument("--onnx-file", default=os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx"))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("EMBEDDING_THREADS", 0)))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-batch-tokens", type=int, default=8192)
+    parser.add_argument("--texts", default=None, help="File with one text per line")
+    parser.add_argument("--count", type=int, default=1000, help="Chunks to embed")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--tolerance", type=float, default=0.99, help="Minimum cosine similarity for parity")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64], help="Concurrent questioners")
+    parser.add_argument("--ingest", action="store_true", help="Embed upload chunks alongside the questions")
+    parser.add_argument("--bulk-batch-size", type=int, default=16)
+    parser.add_argument("--batch-window-ms", type=float, default=2)
+    args = parser.parse_args()
+    sys.exit({"parity": parity, "throughput": throughput, "server": server}[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-request Chroma construction against the shared VectorStoreRegistry.
+
+Simulates concurrent /ask traffic (a count for has_documents followed by a user and a
+common search) and reports per-request latency for both strategies.
+
+Usage: python benchmark_vector_stores.py --requests 500 --concurrency 16
+"""
+
+import argparse
+import hashlib
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from vector_store_registry import VectorStoreRegistry, COMMON_COLLECTION_NAME
+
+
+class HashEmbeddings(Embeddings):
+    """Cheap deterministic embeddings so the benchmark measures store setup, not the model"""
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [digest[i % len(digest)] / 255.0 for i in range(self.dimensions)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def seed(persist_directory: str, embeddings: Embeddings, users: int):
+    texts = [f"Sample chunk {i} about section {i % 50} of the policy" for i in range(200)]
+    for collection_name in [COMMON_COLLECTION_NAME] + [f"user_user{u}" for u in range(users)]:
+        store = Chroma(collection_name=collection_name, embedding_function=embeddings,
+                       persist_directory=persist_directory)
+        store.add_texts(texts, metadatas=[{"source": "bench.txt"}] * len(texts))
+
+
+def fresh_request(persist_directory: str, embeddings: Embeddings, user_id: str):
+    def store(name):
+        return Chroma(collection_name=name, embedding_function=embeddings, persist_directory=persist_directory)
+    store(f"user_{user_id}")._collection.count()
+    store(f"user_{user_id}").similarity_search_with_score("what does section 7 say?", k=4)
+    store(COMMON_COLLECTION_NAME).similarity_search_with_score("what does section 7 say?", k=4)
+
+
+def registry_request(registry: VectorStoreRegistry, user_id: str):
+    registry.get_user_store(user_id)._collection.count()
+    registry.get_user_store(user_id).similarity_search_with_score("what does section 7 say?", k=4)
+    registry.get_common_store().similarity_search_with_score("what does section 7 say?", k=4)
+
+
+def run(label: str, func, requests: int, concurrency: int, users: int):
+    def timed(i):
+        start = time.perf_counter()
+        func(f"user{i % users}")
+        return time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(timed, range(requests)))
+    wall = time.perf_counter() - wall_start
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<10} mean={statistics.mean(latencies) * 1000:8.2f}ms  "
+          f"p95={p95 * 1000:8.2f}ms  throughput={requests / wall:8.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    embeddings = HashEmbeddings()
+    with tempfile.TemporaryDirectory() as persist_directory:
+        seed(persist_directory, embeddings, args.users)
+        registry = VectorStoreRegistry(embeddings, persist_directory, max_user_stores=args.users)
+        run("fresh", lambda u: fresh_request(persist_directory, embeddings, u),
+            args.requests, args.concurrency, args.users)
+        run("registry", lambda u: registry_request(registry, u),
+            args.requests, args.concurrency, args.users)
+        print(f"registry stats: {registry.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Read-only, memory-mapped IVF index for the shared common_knowledge collection.
+
+The index is built offline from the Chroma collection (by populate_common_knowledge.py or
+`python common_index.py build`). Vectors are stored as a float32 or int8-quantized .npy matrix
+grouped by IVF list, and chunk texts and metadata as flat byte files with offset tables. Every
+file is opened with mmap, so all worker processes on a host share one copy through the OS page
+cache. Distances are squared L2, the same scale Chroma reports for the user collections.
+
+After building, recall@k is measured against brute-force search on rows held out of the k-means
+sample. The smallest nprobe reaching the target recall is stored with the index and used by default.
+
+Usage: python common_index.py build [--quantize int8] [--target-recall 0.95] [--recall-k 20]
+"""
+
+import os
+import math
+import json
+import shutil
+import argparse
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+import numpy as np
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def _kmeans(sample: np.ndarray, nlist: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(sample, centroids)
+        for c in range(nlist):
+            members = sample[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                centroids[c] = sample[rng.integers(len(sample))]
+    return centroids
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, block: int = 20000) -> np.ndarray:
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block):
+        chunk = vectors[start:start + block]
+        assignments[start:start + block] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def _exact_neighbours(vectors: np.ndarray, query_rows: np.ndarray, k: int, block: int = 20000) -> np.ndarray:
+    """Brute-force k nearest rows (by squared L2) for each query row, excluding the row itself"""
+    queries = np.asarray(vectors[query_rows], dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_distances = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+        distances = (chunk ** 2).sum(axis=1) - 2 * queries @ chunk.T
+        rows = np.broadcast_to(np.arange(start, start + len(chunk)), distances.shape)
+        distances = np.where(rows == query_rows[:, None], np.inf, distances)
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_distances = np.concatenate([best_distances, distances], axis=1)
+        keep = np.argpartition(best_distances, min(k, best_distances.shape[1] - 1), axis=1)[:, :k]
+        best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        best_distances = np.take_along_axis(best_distances, keep, axis=1)
+    return best_rows
+
+
+def default_nprobe(nlist: int) -> int:
+    """nprobe for indexes built before recall was calibrated: an eighth of the lists"""
+    return min(nlist, max(8, math.ceil(nlist / 8)))
+
+
+def _write_blobs(path: Path, items: List[bytes]):
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    with open(path.with_suffix(".bin"), "wb") as f:
+        for i, item in enumerate(items):
+            f.write(item)
+            offsets[i + 1] = offsets[i] + len(item)
+    np.save(path.with_suffix(".offsets.npy"), offsets)
+
+
+class CommonKnowledgeIndex:
+    """Memory-mapped IVF index over the common_knowledge vectors, texts and metadata"""
+
+    def __init__(self, path: str, nprobe: Optional[int] = None):
+        self.path = Path(path)
+        self.info = json.loads((self.path / "index.json").read_text())
+        if self.info["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported common index version {self.info['version']}")
+        # An explicit nprobe wins; otherwise use the one calibrated for target recall at build time
+        self.nprobe = nprobe or self.info.get("nprobe") or default_nprobe(self.info["nlist"])
+        self.centroids = np.load(self.path / "centroids.npy")
+        self.list_offsets = np.load(self.path / "lists.npy")
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self.scales = np.load(self.path / "scales.npy") if self.info["quantization"] == "int8" else None
+        self.norms = np.load(self.path / "norms.npy", mmap_mode="r")
+        self.text_offsets = np.load(self.path / "texts.offsets.npy", mmap_mode="r")
+        self.texts = np.memmap(self.path / "texts.bin", dtype=np.uint8, mode="r") if self.text_offsets[-1] else None
+        self.meta_offsets = np.load(self.path / "metadata.offsets.npy", mmap_mode="r")
+        self.metadata = np.memmap(self.path / "metadata.bin", dtype=np.uint8, mode="r")
+        logger.info(f"Opened common index at {path}: {self.info['count']} vectors, "
+                    f"{self.info['nlist']} lists, {self.info['quantization'] or 'float32'}, nprobe {self.nprobe}")
+
+    @classmethod
+    def open_if_exists(cls, path: str, nprobe: Optional[int] = None) -> Optional["CommonKnowledgeIndex"]:
+        if not (Path(path) / "index.json").exists():
+            return None
+        try:
+            return cls(path, nprobe=nprobe)
+        except Exception as e:
+            logger.error(f"Failed to open common index at {path}, falling back to Chroma: {e}")
+            return None
+
+    def __len__(self) -> int:
+        return self.info["count"]
+
+    def _document(self, position: int, distance: float) -> Tuple[Document, float]:
+        start, end = self.text_offsets[position], self.text_offsets[position + 1]
+        text = bytes(self.texts[start:end]).decode("utf-8") if self.texts is not None else ""
+        start, end = self.meta_offsets[position], self.meta_offsets[position + 1]
+        metadata = json.loads(bytes(self.metadata[start:end]))
+        metadata['collection'] = 'common'
+        return Document(page_content=text, metadata=metadata), float(distance)
+
+    def _search_positions(self, query: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions and squared L2 distances of the k nearest stored vectors, closest first"""
+        centroid_distances = ((self.centroids - query) ** 2).sum(axis=1)
+        probes = np.argsort(centroid_distances)[:nprobe]
+
+        positions, distances = [], []
+        for list_id in probes:
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            block = self.vectors[start:end]
+            if self.scales is not None:
+                dots = (block @ (query * self.scales)).astype(np.float32)
+            else:
+                dots = block @ query
+            distances.append(self.norms[start:end] - 2 * dots + query @ query)
+            positions.append(np.arange(start, end))
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        positions = np.concatenate(positions)
+        distances = np.concatenate(distances)
+        top = np.argpartition(distances, min(k, len(distances) - 1))[:k]
+        top = top[np.argsort(distances[top])]
+        return positions[top], distances[top]
+
+    def search(self, query_vector: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        """Return the k nearest chunks as (Document, squared L2 distance), closest first"""
+        if not len(self):
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        positions, distances = self._search_positions(query, k, self.nprobe)
+        return [self._document(int(position), max(float(distance), 0.0))
+                for position, distance in zip(positions, distances)]
+
+    def _recall(self, vectors: np.ndarray, order: np.ndarray, query_rows: np.ndarray, exact: np.ndarray,
+                nprobe: int) -> float:
+        k = exact.shape[1]
+        hits = 0
+        for row, expected in zip(query_rows, exact):
+            positions, _ = self._search_positions(np.asarray(vectors[row], dtype=np.float32), k + 1, nprobe)
+            found = [found_row for found_row in order[positions] if found_row != row][:k]
+            hits += len(set(found) & set(expected.tolist()))
+        return hits / (len(query_rows) * k)
+
+    def calibrate(self, vectors: np.ndarray, order: np.ndarray, query_rows: np.ndarray, k: int,
+                  target_recall: float) -> Dict[str, Any]:
+        """Find the smallest nprobe whose recall@k against brute force reaches the target
+
+        vectors are the unquantized rows in their original order, and order maps index positions
+        to those rows. nprobe is doubled until the target is reached, then bisected to within
+        about 1/16. Returns the chosen nprobe with the recall measured at every nprobe tried.
+        """
+        nlist = self.info["nlist"]
+        exact = _exact_neighbours(vectors, query_rows, k)
+        curve = {}
+
+        def measure(nprobe: int) -> bool:
+            curve[nprobe] = self._recall(vectors, order, query_rows, exact, nprobe)
+            logger.info(f"recall@{k} with nprobe {nprobe}: {curve[nprobe]:.3f}")
+            return curve[nprobe] >= target_recall
+
+        low, high = 0, 1
+        while not measure(high) and high < nlist:
+            low, high = high, min(high * 2, nlist)
+        if curve[high] >= target_recall:
+            while high - low > max(1, high // 16):
+                middle = (low + high) // 2
+                if measure(middle):
+                    high = middle
+                else:
+                    low = middle
+        return {"nprobe": high, "k": k, "queries": len(query_rows), "target": target_recall,
+                "recall": curve[high], "curve": dict(sorted(curve.items()))}
+
+    @classmethod
+    def build(cls, collection, path: str, nlist: Optional[int] = None, quantize: Optional[str] = None,
+              page_size: int = 5000, target_recall: float = 0.95, recall_k: int = 20,
+              recall_queries: int = 200) -> Dict[str, Any]:
+        """Export a Chroma collection into a new index directory, calibrate nprobe, then swap it in atomically"""
+        target = Path(path)
+        staging = target.with_name(target.name + ".building")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        count = collection.count()
+        texts: List[bytes] = []
+        metadatas: List[bytes] = []
+        vectors: Optional[np.ndarray] = None
+        row = 0
+        for offset in range(0, count, page_size):
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            page_vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(staging / "raw.npy", mode="w+", dtype=np.float32,
+                                                    shape=(count, page_vectors.shape[1]))
+            vectors[row:row + len(page_vectors)] = page_vectors
+            for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                texts.append((text or "").encode("utf-8"))
+                metadatas.append(json.dumps({**(metadata or {}), 'chunk_id': chunk_id}).encode("utf-8"))
+            row += len(page_vectors)
+            logger.info(f"Exported {row}/{count} vectors from {collection.name}")
+        if vectors is None:
+            raise ValueError(f"Collection {collection.name} is empty, nothing to index")
+        vectors = vectors[:row]
+
+        # Coarse quantizer: k-means on a sample, then group every vector by its nearest centroid
+        nlist = nlist or max(1, min(int(4 * np.sqrt(row)), row))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(row, size=min(row, nlist * 64), replace=False))
+        sample = vectors[sample_rows]
+        centroids = _kmeans(np.asarray(sample), nlist)
+        assignments = _nearest(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignments, minlength=nlist))
+
+        dim = vectors.shape[1]
+        if quantize == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127.0
+            np.save(staging / "scales.npy", scales.astype(np.float32))
+            stored = np.lib.format.open_memmap(staging / "vectors.npy", mode="w+", dtype=np.int8, shape=(row, dim))
+        elif quantize is None:
+            scales = None
+            stored = np.lib.format.open_memmap(staging / "vectors.npy", mode="w+", dtype=np.float32, shape=(row, dim))
+        else:
+            raise ValueError(f"Unsupported quantization: {quantize}")
+        norms = np.empty(row, dtype=np.float32)
+        for start in range(0, row, 20000):
+            block = np.asarray(vectors[order[start:start + 20000]])
+            if scales is not None:
+                block = np.clip(np.round(block / scales), -127, 127).astype(np.int8)
+                norms[start:start + len(block)] = ((block * scales) ** 2).sum(axis=1)
+            else:
+                norms[start:start + len(block)] = (block ** 2).sum(axis=1)
+            stored[start:start + len(block)] = block
+        stored.flush()
+        del stored
+
+        np.save(staging / "centroids.npy", centroids.astype(np.float32))
+        np.save(staging / "lists.npy", list_offsets)
+        np.save(staging / "norms.npy", norms)
+        _write_blobs(staging / "texts", [texts[i] for i in order])
+        _write_blobs(staging / "metadata", [metadatas[i] for i in order])
+        info = {"version": FORMAT_VERSION, "count": row, "dim": dim, "nlist": nlist,
+                "quantization": quantize, "metric": "l2", "collection": collection.name}
+        (staging / "index.json").write_text(json.dumps(info))
+
+        # Queries come from rows the centroids were not trained on when there are any
+        held_out = np.setdiff1d(np.arange(row), sample_rows)
+        candidates = held_out if len(held_out) else np.arange(row)
+        query_rows = np.sort(rng.choice(candidates, size=min(len(candidates), recall_queries), replace=False))
+        recall = cls(str(staging), nprobe=1).calibrate(vectors, order, query_rows, max(1, min(recall_k, row - 1)),
+                                                       target_recall)
+        del vectors
+        os.remove(staging / "raw.npy")
+        info.update(nprobe=recall.pop("nprobe"), recall=recall)
+        (staging / "index.json").write_text(json.dumps(info))
+
+        previous = target.with_name(target.name + ".previous")
+        shutil.rmtree(previous, ignore_errors=True)
+        if target.exists():
+            target.rename(previous)
+        staging.rename(target)
+        shutil.rmtree(previous, ignore_errors=True)
+        logger.info(f"Built common index at {target}: {row} vectors in {nlist} lists, nprobe {info['nprobe']} "
+                    f"for recall@{recall['k']} {recall['recall']:.3f} (target {target_recall})")
+        return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--chroma-path", default=os.getenv("CHROMA_DB_PATH", "./chroma_db"))
+    parser.add_argument("--index-path", default=None, help="Default: <chroma-path>/common_index")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default: 4 x sqrt(N))")
+    parser.add_argument("--quantize", choices=["int8"], default=None)
+    parser.add_argument("--target-recall", type=float, default=0.95,
+                        help="Recall@k against brute force that the stored nprobe must reach")
+    parser.add_argument("--recall-k", type=int, default=20, help="k for the recall check (RETRIEVAL_CANDIDATES)")
+    parser.add_argument("--recall-queries", type=int, default=200, help="Held-out rows used as recall queries")
+    args = parser.parse_args()
+
+    import chromadb
+    logging.basicConfig(level=logging.INFO)
+    client = chromadb.PersistentClient(path=args.chroma_path)
+    collection = client.get_collection("common_knowledge")
+    index_path = args.index_path or os.getenv("COMMON_INDEX_PATH") or str(Path(args.chroma_path) / "common_index")
+    info = CommonKnowledgeIndex.build(collection, index_path, nlist=args.nlist, quantize=args.quantize,
+                                      target_recall=args.target_recall, recall_k=args.recall_k,
+                                      recall_queries=args.recall_queries)
+    recall = info["recall"]
+    for nprobe, value in recall["curve"].items():
+        print(f"nprobe {nprobe:>5}  recall@{recall['k']} {value:.3f}")
+    print(f"Using nprobe {info['nprobe']} of {info['nlist']} lists: recall@{recall['k']} {recall['recall']:.3f} "
+          f"on {recall['queries']} held-out rows (target {recall['target']})")
+
+
+if __name__ == "__main__":
+    main()
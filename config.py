@@ -19,23 +19,89 @@ class Config:
     ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     
+    # LLM Configuration
+    LLM_CONCURRENCY_LIMIT = int(os.getenv("LLM_CONCURRENCY_LIMIT", 32))  # In-flight calls per provider
+    LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", 60))  # Seconds allowed for an answer, including fallbacks
+    LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "True").lower() == "true"
+    LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))  # Latency percentile that triggers a hedge
+    LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 8))  # Seconds, until latency is known
+    LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", 1))  # Seconds
+    LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", 100))  # Recent calls kept per provider for scoring
+    LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))  # Consecutive failures
+    LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", 30))  # Seconds before a trial request
+    
     # Database Configuration
     CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+    SOURCE_MANIFEST_PATH = os.getenv("SOURCE_MANIFEST_PATH", str(Path(CHROMA_DB_PATH) / "source_manifest.sqlite3"))
+    COMMON_INDEX_PATH = os.getenv("COMMON_INDEX_PATH", str(Path(CHROMA_DB_PATH) / "common_index"))
+    COMMON_INDEX_NPROBE = int(os.getenv("COMMON_INDEX_NPROBE", 0))  # IVF lists scanned per query; 0 uses the calibrated value
+    KEYWORD_INDEX_PATH = os.getenv("KEYWORD_INDEX_PATH", str(Path(CHROMA_DB_PATH) / "keyword_index.sqlite3"))
+    VECTOR_STORE_CACHE_SIZE = int(os.getenv("VECTOR_STORE_CACHE_SIZE", 256))  # Open per-user collection handles
     
     # Document Processing Configuration
     CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
     CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))
     MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 10 * 1024 * 1024))  # 10MB
+    MAX_FILES_PER_UPLOAD = int(os.getenv("MAX_FILES_PER_UPLOAD", 20))
+    UPLOAD_SPOOL_SIZE = int(os.getenv("UPLOAD_SPOOL_SIZE", 2 * 1024 * 1024))  # Bytes per file kept in memory
+    PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", min(4, os.cpu_count() or 1)))  # 1 disables the process pool
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 50))  # Page range size for splitting large PDFs
     
     # Upload Configuration
     UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+    INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 2))  # Background parse/embed workers
+    INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", 32))  # Max pending upload jobs
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))  # Chunks embedded per write
     ALLOWED_EXTENSIONS = {'.pdf', '.txt', '.docx', '.doc', '.md'}
     
+    # Auth Configuration
+    AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))  # Verified ID tokens kept until exp
+    FIREBASE_CERTS_REFRESH_INTERVAL = float(os.getenv("FIREBASE_CERTS_REFRESH_INTERVAL", 3600))  # Seconds, at most
+    
+    # Startup Configuration
+    WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "True").lower() == "true"  # Else build services on first use
+    
     # Logging Configuration
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "False").lower() == "true"  # Per-stage timing header
+    
+    # Embedding Configuration
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", str(Path(CHROMA_DB_PATH) / "embedding_cache.sqlite3"))
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1_000_000))
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # torch (sentence-transformers) or onnx
+    EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "False").lower() == "true"  # int8 weights, onnx backend only
+    EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx")  # ONNX export within the model repo
+    EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))  # Intra-op threads (0 = library default)
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))  # Max texts per model call
+    EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", 8192))  # Padded tokens per onnx batch
+    EMBEDDING_SERVER_ENABLED = os.getenv("EMBEDDING_SERVER_ENABLED", "True").lower() == "true"  # Micro-batch calls
+    EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 2))  # Wait for more requests under load
+    EMBEDDING_BULK_BATCH_SIZE = int(os.getenv("EMBEDDING_BULK_BATCH_SIZE", 16))  # Upload chunks per server batch
     
     # RAG Configuration
     RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 4))  # Number of documents to retrieve
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))  # Max tokens of retrieved context per prompt
+    CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.9))  # Shingle containment to drop a passage
+    CONTEXT_TOKENIZER_MODEL = os.getenv("CONTEXT_TOKENIZER_MODEL", "gpt-3.5-turbo")  # tiktoken model for counting
+    RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", 20))  # Results per search fed into fusion
+    HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "True").lower() == "true"  # BM25 alongside vectors
+    RRF_K = int(os.getenv("RRF_K", 60))  # Reciprocal rank fusion constant
+    USER_RESULTS_QUOTA = int(os.getenv("USER_RESULTS_QUOTA", 0))  # Max user chunks in the top k (0 = no limit)
+    COMMON_RESULTS_QUOTA = int(os.getenv("COMMON_RESULTS_QUOTA", 0))  # Max common chunks in the top k (0 = no limit)
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 10000))
+    QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", 3600))  # Seconds
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 5000))
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))  # Seconds
+    ANSWER_CACHE_SEMANTIC = os.getenv("ANSWER_CACHE_SEMANTIC", "False").lower() == "true"
+    ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", 0.95))  # Question cosine
+    ANSWER_CACHE_CONTEXT_OVERLAP = float(os.getenv("ANSWER_CACHE_CONTEXT_OVERLAP", 0.75))  # Chunk ID Jaccard
+    BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))  # LLM calls in flight per batch request
+    MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", 500))
+    RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 8))  # Threads for off-loop collection searches
+    COMMON_SEARCH_WORKERS = int(os.getenv("COMMON_SEARCH_WORKERS", 4))  # Max common searches in flight
+    USER_SEARCH_TIMEOUT = float(os.getenv("USER_SEARCH_TIMEOUT", 10))  # Seconds
+    COMMON_SEARCH_TIMEOUT = float(os.getenv("COMMON_SEARCH_TIMEOUT", 3))  # Seconds
     
     @classmethod
     def setup_logging(cls):
@@ -63,6 +129,9 @@ class Config:
         if not cls.OPENAI_API_KEY:
             errors.append("OpenAI API key is required for embeddings")
         
+        if cls.EMBEDDING_BACKEND not in ("torch", "onnx"):
+            errors.append(f"EMBEDDING_BACKEND must be torch or onnx, got {cls.EMBEDDING_BACKEND}")
+        
         # Create necessary directories
         cls.UPLOAD_DIR.mkdir(exist_ok=True)
         Path(cls.CHROMA_DB_PATH).parent.mkdir(exist_ok=True)
@@ -0,0 +1,148 @@
+import heapq
+import re
+from typing import List, Optional, Tuple
+import logging
+
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # Installed with langchain-openai; fall back to an estimate without it
+    tiktoken = None
+
+
+class TokenCounter:
+    """Counts tokens with the model's tiktoken encoding, or estimates ~4 characters per token"""
+
+    def __init__(self, model: str = "gpt-3.5-turbo"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                # Non-OpenAI models: cl100k is a close enough proxy for budgeting
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        else:
+            logger.warning("tiktoken not installed, estimating context tokens from character counts")
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+        return text[:max_tokens * 4]
+
+
+class ContextBuilder:
+    """Assembles the prompt context from ranked chunks within a token budget
+
+    Chunks from the same source (and page) that overlap or touch, according to the splitter's
+    start_index, are merged into one passage ranked at its best chunk. Passages whose word
+    shingles are mostly contained in an already selected passage are dropped. Passages are then
+    added in rank order until the budget is used. A merged passage that does not fit is split
+    back into its chunks, each taking its own rank; the first single chunk that does not fit is
+    truncated if at least min_passage_tokens remain.
+    """
+
+    def __init__(self, token_budget: int = 2000, dedup_threshold: float = 0.9, model: str = "gpt-3.5-turbo",
+                 min_passage_tokens: int = 50, separator: str = "\n\n"):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.min_passage_tokens = min_passage_tokens
+        self.separator = separator
+        self.counter = TokenCounter(model)
+
+    @staticmethod
+    def _merge_key(doc: Document) -> Optional[Tuple]:
+        if doc.metadata.get('start_index') is None:
+            return None
+        return doc.metadata.get('collection'), doc.metadata.get('source'), doc.metadata.get('page')
+
+    def _merge_adjacent(self, documents: List[Document]) -> List[Tuple[int, str, List[Tuple[int, Document]]]]:
+        """Group ranked chunks into (best rank, text, ranked members) passages, ordered by best rank"""
+        passages: List[Tuple[int, str, List[Tuple[int, Document]]]] = []
+        groups = {}
+        for rank, doc in enumerate(documents):
+            key = self._merge_key(doc)
+            if key is None:
+                passages.append((rank, doc.page_content, [(rank, doc)]))
+            else:
+                groups.setdefault(key, []).append((rank, doc))
+
+        for members in groups.values():
+            members.sort(key=lambda member: member[1].metadata['start_index'])
+            run_rank, run_members = members[0][0], [members[0]]
+            run_text = members[0][1].page_content
+            run_end = members[0][1].metadata['start_index'] + len(run_text)
+            for rank, doc in members[1:]:
+                start = doc.metadata['start_index']
+                if start <= run_end:
+                    run_text += doc.page_content[run_end - start:]
+                    run_end = max(run_end, start + len(doc.page_content))
+                    run_rank = min(run_rank, rank)
+                    run_members.append((rank, doc))
+                    continue
+                passages.append((run_rank, run_text, run_members))
+                run_rank, run_members, run_text = rank, [(rank, doc)], doc.page_content
+                run_end = start + len(run_text)
+            passages.append((run_rank, run_text, run_members))
+
+        passages.sort(key=lambda passage: passage[0])
+        return passages
+
+    @staticmethod
+    def _shingles(text: str, size: int = 3) -> frozenset:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < size:
+            return frozenset([" ".join(words)]) if words else frozenset()
+        return frozenset(" ".join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+    def _is_duplicate(self, shingles: frozenset, selected: List[frozenset]) -> bool:
+        for other in selected:
+            smaller = min(len(shingles), len(other))
+            if smaller and len(shingles & other) / smaller >= self.dedup_threshold:
+                return True
+        return False
+
+    def build(self, documents: List[Document]) -> Tuple[str, List[Document]]:
+        """Return the context string and the chunks that made it in"""
+        separator_tokens = self.counter.count(self.separator)
+        remaining = self.token_budget
+        parts: List[str] = []
+        used: List[Document] = []
+        selected_shingles: List[frozenset] = []
+        dropped = 0
+
+        # Ranks are unique across passages, so the heap never compares past them
+        passages = self._merge_adjacent(documents)
+        while passages:
+            _, text, members = heapq.heappop(passages)
+            shingles = self._shingles(text)
+            if self._is_duplicate(shingles, selected_shingles):
+                dropped += 1
+                continue
+            cost = self.counter.count(text) + (separator_tokens if parts else 0)
+            if cost > remaining:
+                if len(members) > 1:
+                    # Truncating the merged text would keep its start, not its best chunk
+                    for rank, doc in members:
+                        heapq.heappush(passages, (rank, doc.page_content, [(rank, doc)]))
+                    continue
+                available = remaining - (separator_tokens if parts else 0)
+                if available >= self.min_passage_tokens:
+                    parts.append(self.counter.truncate(text, available))
+                    used.append(members[0][1])
+                break
+            parts.append(text)
+            used.extend(doc for _, doc in members)
+            selected_shingles.append(shingles)
+            remaining -= cost
+
+        if dropped:
+            logger.debug(f"Dropped {dropped} near-duplicate passages from the context")
+        return self.separator.join(parts), used
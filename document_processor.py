@@ -1,32 +1,87 @@
+import io
 import os
-from typing import List
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterator, List, Optional, Tuple
 from pathlib import Path
 import logging
 
+import docx2txt
+from pypdf import PdfReader
+
 from langchain_community.document_loaders import (
     PyPDFLoader,
     TextLoader,
-    Docx2txtLoader,
-    UnstructuredMarkdownLoader
+    Docx2txtLoader
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 
+from metrics import DOCUMENT_BYTES, DOCUMENT_CHUNKS, PARSE_SECONDS, SPLIT_SECONDS
+
+if TYPE_CHECKING:
+    from upload_stream import SpooledUpload
+
 logger = logging.getLogger(__name__)
 
+# Per-process DocumentProcessor used by process pool workers
+_worker_processor = None
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int):
+    global _worker_processor
+    _worker_processor = DocumentProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _split_task(file_path: str, page_range: Optional[Tuple[int, int]]) -> Tuple[List[Document], float, float]:
+    # Timings travel back with the chunks so the parent process can record them
+    return _worker_processor._split_file_timed(file_path, page_range)
+
+
+def _split_bytes_task(filename: str, data: bytes) -> Tuple[List[Document], float, float]:
+    return _worker_processor._split_stream_timed(filename, io.BytesIO(data))
+
+
+def compute_file_hash(file_path: str) -> str:
+    """SHA-256 of a file's bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_chunk_id(source: str, chunk_index: int, content: str) -> str:
+    """Content-derived chunk ID: stable across re-uploads of the same text under the same source"""
+    chunk_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{source}\0{chunk_index}\0{chunk_hash}".encode("utf-8")).hexdigest()
+
+
 class DocumentProcessor:
     """Handles document loading, parsing, and text splitting"""
     
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 max_workers: int = 1, pdf_pages_per_task: int = 50):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.max_workers = max_workers
+        self.pdf_pages_per_task = pdf_pages_per_task
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
         
         # Initialize text splitter
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             length_function=len,
-            separators=["\n\n", "\n", " ", ""]
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True  # Lets the context builder merge overlapping neighbours
         )
         
         # Supported file extensions
@@ -43,22 +98,28 @@ class DocumentProcessor:
         extension = Path(filename).suffix.lower()
         return extension in self.supported_extensions
     
-    def process_documents(self, file_paths: List[str]) -> List[Document]:
-        """Process multiple documents and return split text chunks"""
+    def process_documents(self, file_paths: List[str], parallel: Optional[bool] = None) -> List[Document]:
+        """Process multiple documents and return split text chunks
+        
+        With parallel enabled (the default when max_workers > 1), files and page ranges of large
+        PDFs are loaded and split on a process pool; chunks are returned in the same order as
+        the serial path.
+        """
+        if parallel is None:
+            parallel = self.max_workers > 1
+        
+        if parallel:
+            return self._process_documents_parallel(file_paths)
+        
         all_documents = []
         
         for file_path in file_paths:
             try:
-                # Load document
-                documents = self._load_document(file_path)
-                
-                # Split documents into chunks
-                split_docs = self.text_splitter.split_documents(documents)
+                # Load document and split into chunks
+                split_docs = self._split_file(file_path)
                 
                 # Add source metadata
-                for doc in split_docs:
-                    doc.metadata['source'] = os.path.basename(file_path)
-                    doc.metadata['file_path'] = file_path
+                self._add_source_metadata(file_path, split_docs)
                 
                 all_documents.extend(split_docs)
                 logger.info(f"Processed {file_path}: {len(split_docs)} chunks")
@@ -69,6 +130,236 @@ class DocumentProcessor:
         
         return all_documents
     
+    def _process_documents_parallel(self, file_paths: List[str]) -> List[Document]:
+        """Spread per-file (and per-page-range) loading and splitting across a process pool"""
+        tasks = []
+        for file_path in file_paths:
+            for page_range in self._plan_page_ranges(file_path):
+                tasks.append((file_path, page_range))
+        
+        executor = self._get_executor()
+        futures = [executor.submit(_split_task, file_path, page_range) for file_path, page_range in tasks]
+        
+        # Collect in task order so chunk order matches the serial path
+        chunks_by_file: Dict[str, List[Document]] = {file_path: [] for file_path in file_paths}
+        for (file_path, _), future in zip(tasks, futures):
+            try:
+                split_docs, load_seconds, split_seconds = future.result()
+                self._observe_split(file_path, load_seconds, split_seconds)
+                chunks_by_file[file_path].extend(split_docs)
+            except Exception as e:
+                logger.error(f"Error processing {file_path}: {e}")
+                for pending in futures:
+                    pending.cancel()
+                raise
+        
+        all_documents = []
+        for file_path in file_paths:
+            split_docs = chunks_by_file[file_path]
+            self._add_source_metadata(file_path, split_docs)
+            all_documents.extend(split_docs)
+            logger.info(f"Processed {file_path}: {len(split_docs)} chunks")
+        
+        return all_documents
+    
+    def iter_uploads(self, uploads: List["SpooledUpload"],
+                     parallel: Optional[bool] = None) -> Iterator[Tuple["SpooledUpload", Iterator[Document]]]:
+        """Yield each upload with an iterator over its chunks, parsing several files at once on the pool
+        
+        With the process pool, files other than large PDFs are sent to workers whole, at most two
+        per worker ahead of the upload being consumed; large PDFs stream by page range as in
+        iter_upload_chunks. Consume each upload's chunks before moving on to the next.
+        """
+        if parallel is None:
+            parallel = self.max_workers > 1
+        if not parallel:
+            for upload in uploads:
+                yield upload, self.iter_upload_chunks(upload, parallel=False)
+            return
+        
+        executor = self._get_executor()
+        pending = deque()
+        remaining = iter(uploads)
+        try:
+            while True:
+                # Bounded read-ahead: parsed files wait in memory only until the consumer catches up
+                while len(pending) < 2 * self.max_workers:
+                    upload = next(remaining, None)
+                    if upload is None:
+                        break
+                    future = None
+                    if self._pdf_page_count(upload) <= self.pdf_pages_per_task:
+                        upload.file.seek(0)
+                        future = executor.submit(_split_bytes_task, upload.filename, upload.file.read())
+                    pending.append((upload, future))
+                if not pending:
+                    return
+                upload, future = pending.popleft()
+                if future is None:
+                    yield upload, self.iter_upload_chunks(upload, parallel=True)
+                else:
+                    yield upload, self._tag_upload_chunks(upload, iter([future.result()]))
+        finally:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+    
+    def iter_upload_chunks(self, upload: "SpooledUpload", parallel: Optional[bool] = None) -> Iterator[Document]:
+        """Yield an upload's chunks as its pages are read and split, with only a few pages in memory
+        
+        PDF pages are extracted one at a time; with the process pool, a large PDF's page ranges
+        are read ahead by at most two per worker. Chunks come out in document order either way.
+        """
+        if parallel is None:
+            parallel = self.max_workers > 1
+        return self._tag_upload_chunks(upload, self._iter_upload_splits(upload, parallel))
+    
+    def _tag_upload_chunks(self, upload: "SpooledUpload",
+                           splits: Iterator[Tuple[List[Document], float, float]]) -> Iterator[Document]:
+        chunk_index = 0
+        load_seconds = split_seconds = 0.0
+        try:
+            for split_docs, load_time, split_time in splits:
+                load_seconds += load_time
+                split_seconds += split_time
+                DOCUMENT_CHUNKS.inc(len(split_docs))
+                for doc in split_docs:
+                    self._tag_chunk(doc, chunk_index, upload.filename, upload.filename, upload.size, upload.file_hash)
+                    chunk_index += 1
+                    yield doc
+        except Exception as e:
+            logger.error(f"Error processing {upload.filename}: {e}")
+            raise
+        
+        self._observe_split(upload.filename, load_seconds, split_seconds)
+        DOCUMENT_BYTES.inc(upload.size)
+        logger.info(f"Processed {upload.filename}: {chunk_index} chunks")
+    
+    @staticmethod
+    def _pdf_page_count(upload: "SpooledUpload") -> int:
+        """Pages in an uploaded PDF, or 0 for other files"""
+        if Path(upload.filename).suffix.lower() != '.pdf':
+            return 0
+        upload.file.seek(0)
+        return len(PdfReader(upload.file).pages)
+    
+    def _iter_upload_splits(self, upload: "SpooledUpload",
+                            parallel: bool) -> Iterator[Tuple[List[Document], float, float]]:
+        """Yield (chunks, load seconds, split seconds) per PDF page or page range, or once for other files"""
+        if Path(upload.filename).suffix.lower() != '.pdf':
+            yield self._split_stream_timed(upload.filename, upload.file)
+            return
+        
+        upload.file.seek(0)
+        reader = PdfReader(upload.file)
+        if parallel and len(reader.pages) > self.pdf_pages_per_task:
+            yield from self._iter_page_ranges_parallel(upload, len(reader.pages))
+            return
+        
+        for number, page in enumerate(reader.pages):
+            start = time.perf_counter()
+            document = Document(page_content=page.extract_text(), metadata={'source': upload.filename, 'page': number})
+            loaded = time.perf_counter()
+            split_docs = self.text_splitter.split_documents([document])
+            yield split_docs, loaded - start, time.perf_counter() - loaded
+    
+    def _iter_page_ranges_parallel(self, upload: "SpooledUpload",
+                                   page_count: int) -> Iterator[Tuple[List[Document], float, float]]:
+        executor = self._get_executor()
+        pending = deque()
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as temp_file:
+            # Page-range workers open the PDF themselves, so they need it under a name
+            upload.file.seek(0)
+            shutil.copyfileobj(upload.file, temp_file)
+            temp_file.flush()
+            try:
+                for page_range in self._page_ranges(page_count):
+                    pending.append(executor.submit(_split_task, temp_file.name, page_range))
+                    # Bounded read-ahead: results wait in memory only until the consumer catches up
+                    if len(pending) >= 2 * self.max_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+    
+    def _plan_page_ranges(self, file_path: str) -> List[Optional[Tuple[int, int]]]:
+        """Split large PDFs into page ranges; other files are processed whole"""
+        if Path(file_path).suffix.lower() != '.pdf':
+            return [None]
+        page_count = len(PdfReader(file_path).pages)
+        if page_count <= self.pdf_pages_per_task:
+            return [None]
+        return self._page_ranges(page_count)
+    
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        return [(start, min(start + self.pdf_pages_per_task, page_count))
+                for start in range(0, page_count, self.pdf_pages_per_task)]
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawn rather than fork: the parent holds threads and native model state
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.chunk_size, self.chunk_overlap)
+                )
+            return self._executor
+    
+    def _split_file(self, file_path: str, page_range: Optional[Tuple[int, int]] = None) -> List[Document]:
+        """Load a file (or a page range of a PDF) and split it into chunks"""
+        split_docs, load_seconds, split_seconds = self._split_file_timed(file_path, page_range)
+        self._observe_split(file_path, load_seconds, split_seconds)
+        return split_docs
+    
+    def _split_file_timed(self, file_path: str,
+                          page_range: Optional[Tuple[int, int]] = None) -> Tuple[List[Document], float, float]:
+        """Like _split_file, also returning the load and split times in seconds"""
+        start = time.perf_counter()
+        if page_range is not None:
+            documents = self._load_pdf_pages(file_path, *page_range)
+        else:
+            documents = self._load_document(file_path)
+        loaded = time.perf_counter()
+        split_docs = self.text_splitter.split_documents(documents)
+        return split_docs, loaded - start, time.perf_counter() - loaded
+    
+    def _split_stream_timed(self, filename: str, file: BinaryIO) -> Tuple[List[Document], float, float]:
+        """Load an in-memory upload and split it, returning the chunks plus load and split seconds"""
+        start = time.perf_counter()
+        documents = self._load_stream(filename, file)
+        loaded = time.perf_counter()
+        split_docs = self.text_splitter.split_documents(documents)
+        return split_docs, loaded - start, time.perf_counter() - loaded
+    
+    @staticmethod
+    def _observe_split(file_path: str, load_seconds: float, split_seconds: float):
+        extension = Path(file_path).suffix.lower()
+        PARSE_SECONDS.observe(load_seconds, extension=extension)
+        SPLIT_SECONDS.observe(split_seconds, extension=extension)
+    
+    def _add_source_metadata(self, file_path: str, split_docs: List[Document]):
+        self._tag_chunks(split_docs, os.path.basename(file_path), file_path,
+                         os.path.getsize(file_path), compute_file_hash(file_path))
+    
+    @classmethod
+    def _tag_chunks(cls, split_docs: List[Document], source: str, file_path: str, file_size: int, file_hash: str):
+        for chunk_index, doc in enumerate(split_docs):
+            cls._tag_chunk(doc, chunk_index, source, file_path, file_size, file_hash)
+        DOCUMENT_BYTES.inc(file_size)
+        DOCUMENT_CHUNKS.inc(len(split_docs))
+    
+    @staticmethod
+    def _tag_chunk(doc: Document, chunk_index: int, source: str, file_path: str, file_size: int, file_hash: str):
+        doc.metadata['source'] = source
+        doc.metadata['file_path'] = file_path
+        doc.metadata['file_size'] = file_size
+        doc.metadata['file_hash'] = file_hash
+        doc.metadata['chunk_id'] = compute_chunk_id(source, chunk_index, doc.page_content)
+    
     def _load_document(self, file_path: str) -> List[Document]:
         """Load a single document based on its file type"""
         extension = Path(file_path).suffix.lower()
@@ -79,6 +370,39 @@ class DocumentProcessor:
         loader_func = self.supported_extensions[extension]
         return loader_func(file_path)
     
+    def _load_stream(self, filename: str, file: BinaryIO) -> List[Document]:
+        """Load an uploaded file from its stream, matching what the path-based loaders return"""
+        extension = Path(filename).suffix.lower()
+        file.seek(0)
+        try:
+            if extension == '.pdf':
+                reader = PdfReader(file)
+                return [Document(page_content=page.extract_text(), metadata={'source': filename, 'page': number})
+                        for number, page in enumerate(reader.pages)]
+            if extension == '.txt':
+                data = file.read()
+                try:
+                    text = data.decode('utf-8')
+                except UnicodeDecodeError:
+                    # Fallback to latin-1 encoding
+                    text = data.decode('latin-1')
+                return [Document(page_content=text, metadata={'source': filename})]
+            if extension in ('.docx', '.doc'):
+                return [Document(page_content=docx2txt.process(file), metadata={'source': filename})]
+            if extension == '.md':
+                # UnstructuredMarkdownLoader only reads from a path
+                with tempfile.NamedTemporaryFile(suffix='.md') as temp_file:
+                    shutil.copyfileobj(file, temp_file)
+                    temp_file.flush()
+                    documents = self._load_markdown(temp_file.name)
+                for doc in documents:
+                    doc.metadata['source'] = filename
+                return documents
+        except Exception as e:
+            logger.error(f"Error loading {filename}: {e}")
+            raise
+        raise ValueError(f"Unsupported file type: {extension}")
+    
     def _load_pdf(self, file_path: str) -> List[Document]:
         """Load PDF document"""
         try:
@@ -88,6 +412,19 @@ class DocumentProcessor:
             logger.error(f"Error loading PDF {file_path}: {e}")
             raise
     
+    def _load_pdf_pages(self, file_path: str, start: int, end: int) -> List[Document]:
+        """Load a page range of a PDF, one Document per page like PyPDFLoader"""
+        try:
+            reader = PdfReader(file_path)
+            return [
+                Document(page_content=reader.pages[page].extract_text(),
+                         metadata={'source': file_path, 'page': page})
+                for page in range(start, end)
+            ]
+        except Exception as e:
+            logger.error(f"Error loading PDF {file_path} pages {start}-{end}: {e}")
+            raise
+    
     def _load_text(self, file_path: str) -> List[Document]:
         """Load text document"""
         try:
@@ -116,6 +453,9 @@ class DocumentProcessor:
     
     def _load_markdown(self, file_path: str) -> List[Document]:
         """Load Markdown document"""
+        # unstructured is slow to import and only needed for Markdown, so it loads on first use
+        from langchain_community.document_loaders import UnstructuredMarkdownLoader
+
         try:
             loader = UnstructuredMarkdownLoader(file_path)
             return loader.load()
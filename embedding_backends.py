@@ -0,0 +1,149 @@
+import json
+from pathlib import Path
+from typing import List, Optional, Tuple
+import logging
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx")
+
+
+class OnnxEmbeddings(Embeddings):
+    """sentence-transformers model exported to ONNX, run with ONNX Runtime on CPU
+
+    Needs only onnxruntime, tokenizers and huggingface_hub, so PyTorch is never imported.
+    Texts are sorted by token length and packed into batches of at most max_batch_tokens
+    padded tokens, so short chunks are not padded out to the longest text in a fixed-size
+    batch. Embeddings are mean-pooled and L2-normalized like all-MiniLM-L6-v2's own pipeline.
+    With quantize=True the exported model is dynamically quantized to int8 once and cached
+    next to the download.
+    """
+
+    def __init__(self, model_name: str, threads: int = 0, batch_size: int = 64, max_batch_tokens: int = 8192,
+                 onnx_file: str = "onnx/model.onnx", quantize: bool = False, cache_dir: Optional[str] = None):
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+        def download(filename: str) -> str:
+            # model_name may also be a local directory, e.g. a model baked into the image
+            if Path(model_name).is_dir():
+                return str(Path(model_name) / filename)
+            return hf_hub_download(model_name, filename, cache_dir=cache_dir)
+
+        model_path = download(onnx_file)
+        if quantize:
+            model_path = self._quantize(model_path)
+
+        self.max_seq_length = 256
+        try:
+            with open(download("sentence_bert_config.json")) as f:
+                self.max_seq_length = json.load(f).get("max_seq_length", self.max_seq_length)
+        except Exception as e:
+            logger.debug(f"No sentence_bert_config.json for {model_name}, truncating at {self.max_seq_length}: {e}")
+        self.tokenizer = Tokenizer.from_file(download("tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.no_padding()
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"Loaded ONNX embeddings {model_name} from {model_path} ({threads or 'default'} threads)")
+
+    @staticmethod
+    def _quantize(model_path: str) -> str:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = Path(model_path).with_name(Path(model_path).stem + "_int8.onnx")
+        if not quantized_path.exists():
+            logger.info(f"Quantizing {model_path} to int8...")
+            # Write beside the download under a temporary name so a crash never leaves a partial model
+            partial_path = quantized_path.with_suffix(".partial")
+            quantize_dynamic(model_path, str(partial_path), weight_type=QuantType.QInt8)
+            partial_path.replace(quantized_path)
+        return str(quantized_path)
+
+    def _batches(self, encodings) -> List[List[int]]:
+        """Group text indices, shortest first, into batches bounded by count and padded tokens"""
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        for i in order:
+            # Sorted ascending, so this text is the longest in the batch and sets the padded width
+            if batch and (len(batch) >= self.batch_size
+                          or (len(batch) + 1) * len(encodings[i].ids) > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _run(self, encodings) -> np.ndarray:
+        width = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, feed)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch([text.replace("\n", " ") for text in texts])
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for batch in self._batches(encodings):
+            for i, vector in zip(batch, self._run([encodings[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def create_embeddings(backend: str, model_name: str, threads: int = 0, batch_size: int = 64,
+                      max_batch_tokens: int = 8192, onnx_file: str = "onnx/model.onnx",
+                      quantize: bool = False) -> Tuple[Embeddings, str]:
+    """Build the configured embedding backend
+
+    Returns the embeddings and the name to key cached vectors by: int8 vectors drift from the
+    full-precision model, so they are cached separately, while fp32 ONNX shares the model's keys.
+    """
+    if backend == "onnx":
+        embeddings = OnnxEmbeddings(model_name, threads=threads, batch_size=batch_size,
+                                    max_batch_tokens=max_batch_tokens, onnx_file=onnx_file, quantize=quantize)
+        return embeddings, f"{model_name}:int8" if quantize else model_name
+    if backend == "torch":
+        import torch
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        if threads:
+            torch.set_num_threads(threads)
+        if quantize:
+            logger.warning("EMBEDDING_QUANTIZE only applies to the onnx backend, ignoring it")
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'batch_size': batch_size}
+        )
+        return embeddings, model_name
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
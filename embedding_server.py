@@ -0,0 +1,189 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
+import logging
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import EMBED_SERVER_BATCH_TEXTS, EMBED_SERVER_WAIT_SECONDS
+
+if TYPE_CHECKING:
+    from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+QUERY = 0
+BULK = 1
+_PRIORITY_NAMES = {QUERY: "query", BULK: "bulk"}
+
+
+@dataclass
+class _Request:
+    texts: List[str]
+    priority: int
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class EmbeddingServer(Embeddings):
+    """Micro-batches embedding calls from concurrent requests onto one model thread
+
+    Callers enqueue texts and wait on a future (or await it from a coroutine). The model
+    thread takes the highest-priority request, adds whatever else of the same priority is
+    already queued, and runs them as one batch, so questions are never stuck behind upload
+    chunks and the two are never mixed in a batch. Question batches hold up to max_batch_size
+    texts; bulk batches are capped at bulk_batch_size, so a question arriving during ingestion
+    waits for at most one small bulk batch.
+
+    A lone request runs immediately. Only once requests have been seen arriving together
+    does the thread hold a batch open for up to batch_window seconds to let more join.
+    Questions and chunks are embedded the same way, which holds for the sentence-transformers
+    models used here.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 64, bulk_batch_size: int = 16,
+                 batch_window: float = 0.002):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.bulk_batch_size = bulk_batch_size
+        self.batch_window = batch_window
+        self._queue: "queue.PriorityQueue[Tuple[int, int, Optional[_Request]]]" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._concurrent = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-server", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Finish queued work, then stop the model thread"""
+        if self._thread is not None:
+            self._queue.put((BULK + 1, next(self._sequence), None))
+            self._thread.join()
+            self._thread = None
+
+    def _put(self, request: _Request):
+        self._queue.put((request.priority, next(self._sequence), request))
+
+    def _batch_limit(self, priority: int) -> int:
+        return max(1, self.max_batch_size if priority == QUERY else self.bulk_batch_size)
+
+    def _submit(self, texts: List[str], priority: int) -> List[_Request]:
+        if self._thread is None:
+            self.start()
+        size = self._batch_limit(priority)
+        requests = [_Request(texts[i:i + size], priority) for i in range(0, len(texts), size)]
+        for request in requests:
+            self._put(request)
+        return requests
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        _, _, first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first.texts)
+        limit = self._batch_limit(first.priority)
+        deadline = time.perf_counter() + self.batch_window if self._concurrent else None
+        while size < limit:
+            try:
+                timeout = None if deadline is None else deadline - time.perf_counter()
+                if timeout is None or timeout <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            request = item[2]
+            if request is None or request.priority != first.priority or size + len(request.texts) > limit:
+                self._queue.put(item)  # Keeps its sequence number, so it stays at the front of its priority
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # Skip requests whose waiting coroutine was cancelled, e.g. by a search timeout
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for request in batch for text in request.texts]
+            started = time.perf_counter()
+            priority = _PRIORITY_NAMES[batch[0].priority]
+            for request in batch:
+                EMBED_SERVER_WAIT_SECONDS.observe(started - request.enqueued_at, priority=priority)
+            EMBED_SERVER_BATCH_TEXTS.observe(len(texts), priority=priority)
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                self._concurrent = False
+                logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+            else:
+                # Hold the next batch open only while requests are arriving together. Checked before
+                # answering, so a lone caller's next request isn't mistaken for a concurrent one
+                self._concurrent = len(batch) > 1 or not self._queue.empty()
+                offset = 0
+                for request in batch:
+                    request.future.set_result(vectors[offset:offset + len(request.texts)])
+                    offset += len(request.texts)
+            with self._lock:
+                self.batches += 1
+                self.texts += len(texts)
+
+    @staticmethod
+    def _collect(results: List[List[List[float]]]) -> List[List[float]]:
+        return [vector for vectors in results for vector in vectors]
+
+    def embed(self, texts: List[str], priority: int = BULK) -> List[List[float]]:
+        """Embed texts from a worker thread, blocking until their batch has run"""
+        if not texts:
+            return []
+        return self._collect([request.future.result() for request in self._submit(texts, priority)])
+
+    async def aembed(self, texts: List[str], priority: int = QUERY) -> List[List[float]]:
+        """Embed texts from a coroutine without tying up a thread while waiting"""
+        if not texts:
+            return []
+        requests = self._submit(texts, priority)
+        return self._collect(await asyncio.gather(*(asyncio.wrap_future(r.future) for r in requests)))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts, BULK)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text], QUERY)[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts, QUERY)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.aembed(texts, BULK)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed([text], QUERY))[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "texts": self.texts,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "queued": self._queue.qsize()
+            }
@@ -0,0 +1,161 @@
+import threading
+import time
+import uuid
+import queue
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Optional
+import logging
+
+from upload_stream import SpooledUpload
+
+if TYPE_CHECKING:
+    # Annotations only: main imports this module before the services are built
+    from langchain.schema import Document
+    from document_processor import DocumentProcessor
+    from rag_service import RAGService
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionQueueFull(Exception):
+    """Raised when the ingestion queue cannot accept another job"""
+
+
+@dataclass
+class IngestionJob:
+    """State of one background upload, as reported by the job status endpoint"""
+    job_id: str
+    user_id: str
+    uploads: List[SpooledUpload]
+    stage: str = "queued"
+    current_file: Optional[str] = None
+    files_skipped: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.stage in ("completed", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = None
+        throughput = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            throughput = self.chunks_embedded / elapsed if elapsed > 0 else 0.0
+        return {
+            "job_id": self.job_id,
+            "stage": self.stage,
+            "current_file": self.current_file,
+            "files": [upload.filename for upload in self.uploads],
+            "files_skipped": self.files_skipped,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_per_second": throughput,
+            "elapsed_seconds": elapsed,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class IngestionQueue:
+    """Bounded queue of upload jobs parsed and embedded by a pool of background workers"""
+
+    def __init__(self, document_processor: "DocumentProcessor", rag_service: "RAGService",
+                 workers: int = 2, max_pending: int = 32, retention: int = 1000):
+        self.document_processor = document_processor
+        self.rag_service = rag_service
+        self.retention = retention
+        self._queue: "queue.Queue[IngestionJob]" = queue.Queue(maxsize=max_pending)
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"ingestion-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        logger.info(f"IngestionQueue started with {workers} workers (max {max_pending} pending jobs)")
+
+    def submit(self, user_id: str, uploads: List[SpooledUpload]) -> IngestionJob:
+        """Queue received uploads; the job owns them from here and closes them when done"""
+        job = IngestionJob(job_id=uuid.uuid4().hex, user_id=user_id, uploads=uploads)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.job_id]
+            raise IngestionQueueFull("Ingestion queue is full, try again later")
+        with self._lock:
+            self._prune()
+        logger.info(f"Queued ingestion job {job.job_id} for user {user_id} ({len(uploads)} files)")
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        while len(self._jobs) > self.retention:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if not oldest.done:
+                break
+            del self._jobs[oldest_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job: IngestionJob):
+        job.started_at = time.time()
+        try:
+            # Re-uploads of unchanged files cost nothing: they were hashed while being received
+            changed_uploads = [
+                upload for upload in job.uploads
+                if not self.rag_service.is_unchanged(job.user_id, upload.filename, upload.file_hash)
+            ]
+            job.files_skipped = len(job.uploads) - len(changed_uploads)
+
+            def on_progress(count: int):
+                job.chunks_embedded += count
+
+            def staged(chunks: Iterator["Document"]) -> Iterator["Document"]:
+                # Parsing while waiting on the next chunk, embedding while the consumer batches and writes
+                for chunk in chunks:
+                    job.chunks_total += 1
+                    job.stage = "embedding"
+                    yield chunk
+                    job.stage = "parsing"
+                job.stage = "embedding"
+
+            # Each file is embedded and written batch by batch as its chunks arrive; with the process
+            # pool, the next few files are already being parsed meanwhile
+            job.stage = "parsing"
+            for upload, chunks in self.document_processor.iter_uploads(changed_uploads):
+                job.current_file = upload.filename
+                job.stage = "parsing"
+                self.rag_service.add_document_stream(job.user_id, upload.filename, upload.file_hash,
+                                                     staged(chunks), progress_callback=on_progress)
+            job.current_file = None
+            job.stage = "completed"
+            logger.info(f"Ingestion job {job.job_id} completed: {job.chunks_embedded} chunks")
+        except Exception as e:
+            job.stage = "failed"
+            job.error = str(e)
+            logger.error(f"Ingestion job {job.job_id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            for upload in job.uploads:
+                upload.close()
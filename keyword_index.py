@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+BM25 keyword index for the Chroma collections, kept in SQLite FTS5.
+
+Each collection gets its own FTS5 table, so BM25 term statistics are per collection just like
+the vector search. Rows are keyed by a hash of the Chroma chunk ID, which makes adds idempotent
+and lets deletions and upserts mirror the vector store exactly.
+
+Usage: python keyword_index.py build [--collection common_knowledge]
+"""
+
+import os
+import re
+import json
+import hashlib
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i if in is it its me my of on or
+our should that the their there these this to under was what when where which who why will
+with would you your
+""".split())
+
+
+def _rowid(chunk_id: str) -> int:
+    # 60-bit positive integer so it fits SQLite's signed 64-bit rowid
+    return int(hashlib.sha256(chunk_id.encode("utf-8")).hexdigest()[:15], 16)
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 OR query of quoted terms, or None if nothing is searchable"""
+    terms = []
+    for term in re.findall(r"\w+", text.lower()):
+        if term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class KeywordIndex:
+    """Per-collection BM25 indexes over chunk text, stored in one SQLite database
+
+    Writes share one connection and a lock. In WAL mode readers never wait for them, so each
+    searching thread gets its own connection and searches run without the lock.
+    """
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30)
+        return conn
+
+    @staticmethod
+    def _table(collection: str) -> str:
+        return "kw_" + re.sub(r"\W", "_", collection)
+
+    @staticmethod
+    def _exists(conn: sqlite3.Connection, table: str) -> bool:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+
+    def has_collection(self, collection: str) -> bool:
+        return self._exists(self._reader(), self._table(collection))
+
+    def add(self, collection: str, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]):
+        """Insert or replace chunks, creating the collection's index on first use"""
+        table = self._table(collection)
+        rows = [(_rowid(chunk_id), chunk_id, text or "", json.dumps(metadata or {}))
+                for chunk_id, text, metadata in zip(ids, texts, metadatas)]
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"chunk_id UNINDEXED, content, metadata UNINDEXED, tokenize = 'porter unicode61')"
+            )
+            if rows:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} (rowid, chunk_id, content, metadata) VALUES (?, ?, ?, ?)", rows
+                )
+
+    def delete(self, collection: str, ids: List[str]):
+        table = self._table(collection)
+        with self._lock, self._conn:
+            if self._exists(self._conn, table):
+                self._conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", [(_rowid(i),) for i in ids])
+
+    def drop(self, collection: str):
+        with self._lock, self._conn:
+            self._conn.execute(f"DROP TABLE IF EXISTS {self._table(collection)}")
+
+    def search(self, collection: str, text: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """Return up to k chunks as (Document, BM25 score), best first (SQLite scores are negative)"""
+        query = build_match_query(text)
+        table = self._table(collection)
+        if query is None:
+            return []
+        reader = self._reader()
+        try:
+            rows = reader.execute(
+                f"SELECT chunk_id, content, metadata, bm25({table}) AS score FROM {table} "
+                f"WHERE {table} MATCH ? ORDER BY score LIMIT ?", (query, k)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            if self._exists(reader, table):
+                raise
+            return []  # Not indexed yet, or dropped by a rebuild
+        return [(Document(page_content=content, metadata={**json.loads(metadata), 'chunk_id': chunk_id}), score)
+                for chunk_id, content, metadata, score in rows]
+
+    def rebuild(self, collection: str, chroma_collection, page_size: int = 5000) -> int:
+        """(Re)index every chunk of a Chroma collection, e.g. one that predates the keyword index"""
+        self.drop(collection)
+        self.add(collection, [], [], [])
+        total = chroma_collection.count()
+        for offset in range(0, total, page_size):
+            page = chroma_collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            self.add(collection, page["ids"], page["documents"], page["metadatas"])
+            logger.info(f"Keyword-indexed {min(offset + page_size, total)}/{total} chunks of {collection}")
+        return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--chroma-path", default=os.getenv("CHROMA_DB_PATH", "./chroma_db"))
+    parser.add_argument("--index-path", default=None, help="Default: <chroma-path>/keyword_index.sqlite3")
+    parser.add_argument("--collection", default="common_knowledge")
+    args = parser.parse_args()
+
+    import chromadb
+    logging.basicConfig(level=logging.INFO)
+    client = chromadb.PersistentClient(path=args.chroma_path)
+    index_path = (args.index_path or os.getenv("KEYWORD_INDEX_PATH")
+                  or str(Path(args.chroma_path) / "keyword_index.sqlite3"))
+    KeywordIndex(index_path).rebuild(args.collection, client.get_collection(args.collection))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, Generic, Optional, Tuple, TypeVar
+import logging
+
+from metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LazyComponent(Generic[T]):
+    """A service built on first use or by the background warm-up, whichever comes first
+
+    Concurrent callers wait for the one build in progress; coroutines await it without holding
+    a thread. A failed build is reported by /ready and retried on the next use.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self.factory = factory
+        self._value: Optional[T] = None
+        self._state = "cold"
+        self._error: Optional[str] = None
+        self._seconds: Optional[float] = None
+        self._build: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._state == "ready"
+
+    def _claim_build(self) -> Tuple[Future, bool]:
+        """Return the build in progress (or finished), starting a new one if there is none or it failed"""
+        with self._lock:
+            if self._build is None or (self._build.done() and self._state == "failed"):
+                self._build = Future()
+                self._state = "warming"
+                return self._build, True
+            return self._build, False
+
+    def _run_build(self, build: Future):
+        start = time.perf_counter()
+        try:
+            value = self.factory()
+        except Exception as e:
+            self._state = "failed"
+            self._error = str(e)
+            logger.error(f"Failed to initialize {self.name}: {e}")
+            build.set_exception(e)
+            return
+        self._value = value
+        self._seconds = time.perf_counter() - start
+        self._error = None
+        self._state = "ready"
+        STARTUP_SECONDS.observe(self._seconds, phase=self.name)
+        logger.info(f"Initialized {self.name} in {self._seconds:.2f}s")
+        build.set_result(value)
+
+    def get(self) -> T:
+        """Return the component, building it in this thread if nobody has yet"""
+        if self._state == "ready":
+            return self._value
+        build, owner = self._claim_build()
+        if owner:
+            self._run_build(build)
+        return build.result()
+
+    async def aget(self) -> T:
+        """Return the component, awaiting the build (started on its own thread if needed)"""
+        if self._state == "ready":
+            return self._value
+        build, owner = self._claim_build()
+        if owner:
+            threading.Thread(target=self._run_build, args=(build,), name=f"build-{self.name}", daemon=True).start()
+        return await asyncio.wrap_future(build)
+
+    def peek(self) -> Optional[T]:
+        """Return the component only if it is already built"""
+        return self._value if self._state == "ready" else None
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": self._state, "seconds": self._seconds, "error": self._error}
+
+
+class ComponentRegistry:
+    """The app's lazily built services, warmed up in registration order on a background thread"""
+
+    def __init__(self):
+        self._components: "OrderedDict[str, LazyComponent]" = OrderedDict()
+        self._warmup: Optional[threading.Thread] = None
+
+    def register(self, name: str, factory: Callable[[], T]) -> LazyComponent[T]:
+        component = LazyComponent(name, factory)
+        self._components[name] = component
+        return component
+
+    def warm_up(self):
+        """Build every component in the background, so the server can accept connections meanwhile"""
+        if self._warmup is None:
+            self._warmup = threading.Thread(target=self._warm_all, name="warmup", daemon=True)
+            self._warmup.start()
+
+    def _warm_all(self):
+        start = time.perf_counter()
+        for component in self._components.values():
+            try:
+                component.get()
+            except Exception:
+                pass  # Logged by the component and shown by /ready; first use retries it
+        logger.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+    def status(self) -> Tuple[bool, Dict[str, Dict[str, Any]]]:
+        components = {name: component.status() for name, component in self._components.items()}
+        return all(component.ready for component in self._components.values()), components
@@ -1,29 +1,41 @@
 import os
-import random
-from typing import Dict, List, Optional
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_google_genai import ChatGoogleGenerativeAI
+import time
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from langchain_core.language_models import BaseChatModel
+from config import Config
+from metrics import LLM_SECONDS, LLM_TTFT_SECONDS
+from llm_router import LLMRouter
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cancellation message telling an in-flight call it was abandoned at the deadline, not hedged away
+_DEADLINE_EXCEEDED = "llm deadline exceeded"
+
 class LLMManager:
-    """Manages multiple LLM providers and randomly selects one for each request"""
+    """Manages multiple LLM providers and routes each request to a healthy, fast one"""
     
     def __init__(self):
         self.llms: Dict[str, BaseChatModel] = {}
         self.available_llms: List[str] = []
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.router = LLMRouter(
+            window=Config.LLM_ROUTER_WINDOW,
+            failure_threshold=Config.LLM_CIRCUIT_FAILURE_THRESHOLD,
+            cooldown=Config.LLM_CIRCUIT_COOLDOWN
+        )
         self._initialize_llms()
     
     def _initialize_llms(self):
         """Initialize all available LLMs based on API keys in environment"""
+        # Provider SDKs are imported only for the providers that have keys, as each is slow to import
         
         # OpenAI GPT
         openai_api_key = os.getenv("OPENAI_API_KEY")
         if openai_api_key:
             try:
+                from langchain_openai import ChatOpenAI
                 self.llms["openai"] = ChatOpenAI(
                     api_key=openai_api_key,
                     model="gpt-3.5-turbo",
@@ -39,6 +51,7 @@ class LLMManager:
         anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
         if anthropic_api_key:
             try:
+                from langchain_anthropic import ChatAnthropic
                 self.llms["claude"] = ChatAnthropic(
                     api_key=anthropic_api_key,
                     model="claude-3-haiku-20240307",
@@ -54,6 +67,7 @@ class LLMManager:
         google_api_key = os.getenv("GOOGLE_API_KEY")
         if google_api_key:
             try:
+                from langchain_google_genai import ChatGoogleGenerativeAI
                 self.llms["gemini"] = ChatGoogleGenerativeAI(
                     api_key=google_api_key,
                     model="gemini-1.5-flash-latest",
@@ -68,16 +82,166 @@ class LLMManager:
         if not self.available_llms:
             raise ValueError("No LLM API keys found. Please check your .env file.")
         
+        for llm_name in self.available_llms:
+            self._semaphores[llm_name] = asyncio.Semaphore(self.get_concurrency_limit(llm_name))
+            self.router.register(llm_name)
+        
         logger.info(f"Initialized {len(self.available_llms)} LLMs: {', '.join(self.available_llms)}")
     
     def get_random_llm(self) -> tuple[BaseChatModel, str]:
-        """Get a randomly selected LLM"""
+        """Get an LLM chosen at random, weighted by each provider's recent latency and health"""
         if not self.available_llms:
             raise ValueError("No LLMs available")
         
-        selected_llm = random.choice(self.available_llms)
+        selected_llm = self.router.select(self.available_llms)
         return self.llms[selected_llm], selected_llm
     
+    def _record(self, llm_name: str, latency: float, succeeded: bool):
+        self.router.record(llm_name, latency, succeeded=succeeded)
+        LLM_SECONDS.observe(latency, provider=llm_name, outcome="success" if succeeded else "error")
+    
+    def _record_cancelled(self, llm_name: str, latency: float, error: asyncio.CancelledError):
+        """Record a call cancelled mid-flight: a failure at the deadline, otherwise a lower bound on latency"""
+        if _DEADLINE_EXCEEDED in error.args:
+            self._record(llm_name, latency, succeeded=False)
+        else:
+            self.router.record_latency(llm_name, latency)
+            LLM_SECONDS.observe(latency, provider=llm_name, outcome="cancelled")
+    
+    def invoke(self, llm_name: str, prompt: str) -> str:
+        """Call a provider synchronously, recording its latency and outcome"""
+        start = time.perf_counter()
+        try:
+            response = self.llms[llm_name].invoke(prompt)
+        except Exception:
+            self._record(llm_name, time.perf_counter() - start, succeeded=False)
+            raise
+        self._record(llm_name, time.perf_counter() - start, succeeded=True)
+        return response.content if hasattr(response, 'content') else str(response)
+    
+    def get_concurrency_limit(self, llm_name: str) -> int:
+        """Get the max in-flight async calls for a provider (LLM_CONCURRENCY_LIMIT_<NAME> overrides)"""
+        return int(os.getenv(f"LLM_CONCURRENCY_LIMIT_{llm_name.upper()}", Config.LLM_CONCURRENCY_LIMIT))
+    
+    async def ainvoke(self, llm_name: str, prompt: str) -> str:
+        """Call a provider's native async API, bounded by its concurrency limit"""
+        llm = self.llms[llm_name]
+        async with self._semaphores[llm_name]:
+            start = time.perf_counter()
+            try:
+                response = await llm.ainvoke(prompt)
+            except asyncio.CancelledError as e:
+                self._record_cancelled(llm_name, time.perf_counter() - start, e)
+                raise
+            except Exception:
+                self._record(llm_name, time.perf_counter() - start, succeeded=False)
+                raise
+            self._record(llm_name, time.perf_counter() - start, succeeded=True)
+        return response.content if hasattr(response, 'content') else str(response)
+    
+    def _next_provider(self, tried: List[str]) -> Optional[str]:
+        candidates = [name for name in self.available_llms if name not in tried]
+        return self.router.select(candidates) if candidates else None
+    
+    def _hedge_delay(self, llm_name: str) -> Optional[float]:
+        """Seconds to wait on a provider before hedging, from its latency percentile"""
+        if not Config.LLM_HEDGING_ENABLED or len(self.available_llms) < 2:
+            return None
+        observed = self.router.latency_percentile(llm_name, Config.LLM_HEDGE_PERCENTILE)
+        delay = observed if observed is not None else Config.LLM_HEDGE_DEFAULT_DELAY
+        return max(delay, Config.LLM_HEDGE_MIN_DELAY)
+    
+    async def ainvoke_hedged(self, prompt: str, deadline: Optional[float] = None) -> Tuple[str, str]:
+        """Answer within a deadline, hedging slow calls and falling back on errors
+        
+        The first provider gets until its latency percentile (LLM_HEDGE_PERCENTILE) to answer;
+        after that one hedge request goes to another provider and the first answer wins. A
+        provider that errors is replaced by the next one. Returns (answer, llm_name).
+        """
+        deadline = deadline if deadline is not None else Config.LLM_DEADLINE
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        
+        primary = self.router.select(self.available_llms)
+        tried = [primary]
+        tasks = {asyncio.create_task(self.ainvoke(primary, prompt)): primary}
+        hedge_at = self._hedge_delay(primary)
+        hedged = hedge_at is None
+        errors = []
+        timed_out = False
+        
+        try:
+            while True:
+                elapsed = loop.time() - start
+                if elapsed >= deadline:
+                    timed_out = True
+                    raise TimeoutError(f"No LLM answered within {deadline}s (tried {', '.join(tried)})")
+                timeout = deadline - elapsed
+                if not hedged:
+                    timeout = min(timeout, max(hedge_at - elapsed, 0))
+                
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    llm_name = tasks.pop(task)
+                    if task.exception() is None:
+                        if len(tried) > 1:
+                            logger.info(f"LLM answer from {llm_name} after trying {', '.join(tried)}")
+                        return task.result(), llm_name
+                    errors.append(f"{llm_name}: {task.exception()}")
+                    logger.warning(f"LLM {llm_name} failed, falling back: {task.exception()}")
+                
+                hedge_due = not hedged and loop.time() - start >= hedge_at
+                if tasks and not hedge_due:
+                    continue
+                
+                next_llm = self._next_provider(tried)
+                if next_llm is None:
+                    if not tasks:
+                        raise RuntimeError(f"All LLM providers failed: {'; '.join(errors)}")
+                    hedged = True
+                    continue
+                if hedge_due and tasks:
+                    hedged = True
+                    logger.info(f"Hedging slow {', '.join(tasks.values())} with {next_llm}")
+                tried.append(next_llm)
+                tasks[asyncio.create_task(self.ainvoke(next_llm, prompt))] = next_llm
+        finally:
+            # Losing and overdue requests are cancelled; ainvoke records them as they unwind
+            for task in tasks:
+                task.cancel(_DEADLINE_EXCEEDED if timed_out else None)
+    
+    async def astream(self, llm_name: str, prompt: str, deadline: Optional[float] = None) -> AsyncIterator[str]:
+        """Stream answer tokens from a provider, bounded by its concurrency limit and a deadline"""
+        deadline = deadline if deadline is not None else Config.LLM_DEADLINE
+        llm = self.llms[llm_name]
+        async with self._semaphores[llm_name]:
+            start = time.perf_counter()
+            expires = asyncio.get_running_loop().time() + deadline
+            first_token = True
+            stream = llm.astream(prompt)
+            try:
+                while True:
+                    try:
+                        async with asyncio.timeout_at(expires):
+                            chunk = await anext(stream)
+                    except StopAsyncIteration:
+                        break
+                    text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                    if text:
+                        if first_token:
+                            LLM_TTFT_SECONDS.observe(time.perf_counter() - start, provider=llm_name)
+                            first_token = False
+                        yield text
+            except asyncio.TimeoutError:
+                self._record(llm_name, time.perf_counter() - start, succeeded=False)
+                raise TimeoutError(f"{llm_name} did not finish answering within {deadline}s")
+            except Exception:
+                self._record(llm_name, time.perf_counter() - start, succeeded=False)
+                raise
+            finally:
+                await stream.aclose()
+            self._record(llm_name, time.perf_counter() - start, succeeded=True)
+    
     def get_specific_llm(self, llm_name: str) -> Optional[BaseChatModel]:
         """Get a specific LLM by name"""
         return self.llms.get(llm_name)
@@ -0,0 +1,155 @@
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderHealth:
+    """Rolling latency/error window and circuit breaker state for one LLM provider"""
+
+    def __init__(self, window: int):
+        self.samples: deque = deque(maxlen=window)  # (latency_seconds, succeeded)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_started = 0.0
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+
+class LLMRouter:
+    """Picks providers weighted toward low latency and low error rate, with a circuit breaker
+
+    Weight is (1 - error rate) / p50 latency; providers without successful calls get the mean
+    weight times (1 - error rate), so a new provider is still tried but one that has only failed
+    is not. After failure_threshold consecutive failures a provider's circuit opens for cooldown
+    seconds, then a single trial request is let through to close it again.
+    """
+
+    def __init__(self, window: int = 100, failure_threshold: int = 5, cooldown: float = 30.0,
+                 min_latency: float = 0.05):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.min_latency = min_latency
+        self._providers: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+
+    def _health(self, name: str) -> ProviderHealth:
+        health = self._providers.get(name)
+        if health is None:
+            health = self._providers[name] = ProviderHealth(self.window)
+        return health
+
+    def register(self, name: str):
+        with self._lock:
+            self._health(name)
+
+    def _is_available(self, health: ProviderHealth, now: float) -> bool:
+        if health.open_until == 0.0:
+            return True
+        # Half-open: after the cooldown, let one trial request through (retrying if it never reports back)
+        if now < health.open_until:
+            return False
+        return not health.trial_started or now - health.trial_started > self.cooldown
+
+    def _weight(self, health: ProviderHealth) -> Optional[float]:
+        p50 = health.latency_percentile(50)
+        if p50 is None:
+            return None
+        return max(1.0 - health.error_rate, 0.01) / max(p50, self.min_latency)
+
+    def select(self, candidates: List[str]) -> str:
+        """Choose a provider among candidates"""
+        if not candidates:
+            raise ValueError("No LLMs available")
+        now = time.monotonic()
+        with self._lock:
+            available = [name for name in candidates if self._is_available(self._health(name), now)]
+            if not available:
+                # Every circuit is open: use the one that recovers first rather than failing outright
+                choice = min(candidates, key=lambda name: self._health(name).open_until)
+                logger.warning(f"All LLM circuits open, falling back to {choice}")
+                return choice
+
+            weights = {name: self._weight(self._health(name)) for name in available}
+            known = [w for w in weights.values() if w is not None]
+            default = sum(known) / len(known) if known else 1.0
+            # No successful call yet: start from the mean weight, scaled down by any failures so far
+            choice = random.choices(available, weights=[
+                w if w is not None else max(1.0 - self._health(name).error_rate, 0.01) * default
+                for name, w in weights.items()
+            ])[0]
+
+            health = self._health(choice)
+            if health.open_until and now >= health.open_until:
+                health.trial_started = now
+            return choice
+
+    def record(self, name: str, latency: float, succeeded: bool):
+        """Record the outcome of one call to a provider"""
+        with self._lock:
+            health = self._health(name)
+            health.samples.append((latency, succeeded))
+            health.trial_started = 0.0
+            if succeeded:
+                if health.open_until:
+                    logger.info(f"LLM circuit for {name} closed")
+                health.consecutive_failures = 0
+                health.open_until = 0.0
+                return
+            health.consecutive_failures += 1
+            if health.open_until or health.consecutive_failures >= self.failure_threshold:
+                health.open_until = time.monotonic() + self.cooldown
+                logger.warning(f"LLM circuit for {name} open for {self.cooldown}s "
+                               f"after {health.consecutive_failures} consecutive failures")
+
+    def record_latency(self, name: str, latency: float):
+        """Record a lower bound on latency from an abandoned call, leaving the circuit state alone"""
+        with self._lock:
+            self._health(name).samples.append((latency, True))
+
+    def latency_percentile(self, name: str, percentile: float) -> Optional[float]:
+        with self._lock:
+            return self._health(name).latency_percentile(percentile)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Live per-provider scores for the health endpoint"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for name, health in self._providers.items():
+                if not health.open_until:
+                    state = "closed"
+                elif now >= health.open_until:
+                    state = "half_open"
+                else:
+                    state = "open"
+                result[name] = {
+                    "p50_ms": self._ms(health.latency_percentile(50)),
+                    "p95_ms": self._ms(health.latency_percentile(95)),
+                    "error_rate": health.error_rate,
+                    "samples": len(health.samples),
+                    "consecutive_failures": health.consecutive_failures,
+                    "circuit": state,
+                    "weight": self._weight(health)
+                }
+            return result
+
+    @staticmethod
+    def _ms(seconds: Optional[float]) -> Optional[float]:
+        return seconds * 1000 if seconds is not None else None
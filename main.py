@@ -1,25 +1,93 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header
+import time
+
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import os
+import json
 import random
+import logging
 import uvicorn
-from pathlib import Path
-import shutil
-import firebase_admin
 from dotenv import load_dotenv
-from firebase_admin import credentials, auth
-from rag_service import RAGService
-from llm_manager import LLMManager
-from document_processor import DocumentProcessor
+from ingestion_jobs import IngestionQueueFull
+from upload_stream import UploadError, receive_uploads
+from config import Config
+from lazy_components import ComponentRegistry
+from metrics import REGISTRY, HTTP_REQUEST_SECONDS, STARTUP_SECONDS, start_request_timings, server_timing_header
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
-app = FastAPI(title="RAG LLM Backend", version="1.0.0")
 
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS"))
-firebase_admin.initialize_app(cred)
+
+# Services are built lazily, on first use or by the background warm-up, so the server accepts
+# connections (and answers /health) while models and SDK clients load. Their heavy modules
+# are imported inside these factories for the same reason.
+def _init_token_verifier():
+    import firebase_admin
+    from firebase_admin import credentials
+    from token_verifier import TokenVerifier
+
+    cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS"))
+    firebase_admin.initialize_app(cred)
+    verifier = TokenVerifier(
+        project_id=cred.project_id,
+        max_entries=Config.AUTH_TOKEN_CACHE_SIZE,
+        refresh_interval=Config.FIREBASE_CERTS_REFRESH_INTERVAL
+    )
+    verifier.start()
+    return verifier
+
+
+def _init_llm_manager():
+    from llm_manager import LLMManager
+    return LLMManager()
+
+
+def _init_document_processor():
+    from document_processor import DocumentProcessor
+    return DocumentProcessor(
+        max_workers=Config.PARSE_WORKERS,
+        pdf_pages_per_task=Config.PDF_PAGES_PER_TASK
+    )
+
+
+def _init_rag_service():
+    from rag_service import RAGService
+    return RAGService(llm_manager.get())
+
+
+def _init_ingestion_queue():
+    from ingestion_jobs import IngestionQueue
+    return IngestionQueue(
+        document_processor.get(),
+        rag_service.get(),
+        workers=Config.INGESTION_WORKERS,
+        max_pending=Config.INGESTION_QUEUE_SIZE
+    )
+
+
+components = ComponentRegistry()
+token_verifier = components.register("auth", _init_token_verifier)
+llm_manager = components.register("llms", _init_llm_manager)
+document_processor = components.register("document_processor", _init_document_processor)
+rag_service = components.register("rag_service", _init_rag_service)
+ingestion_queue = components.register("ingestion_queue", _init_ingestion_queue)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if Config.WARMUP_ON_STARTUP:
+        components.warm_up()
+    yield
+
+app = FastAPI(title="RAG LLM Backend", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -30,15 +98,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-llm_manager = LLMManager()
-document_processor = DocumentProcessor()
-rag_service = RAGService(llm_manager)
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code
+    )
+    if Config.SERVER_TIMING_ENABLED and timings:
+        # Streaming responses only include the stages that ran before their first byte
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
 
 # Pydantic models
 class QuestionRequest(BaseModel):
     question: str
 
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+
 class QuestionResponse(BaseModel):
     answer: str
     sources: List[str]
@@ -49,17 +132,26 @@ class StatusResponse(BaseModel):
     message: str
     documents_count: int
 
-# Create upload directory
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+class UploadJobResponse(BaseModel):
+    status: str
+    message: str
+    job_id: str
+
+async def require(component):
+    """Wait for a lazily built service, answering 503 if it failed to initialize"""
+    try:
+        return await component.aget()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Service unavailable ({component.name}): {str(e)}")
 
 # Authentication dependency
 async def get_current_user(authorization: str = Header(...)):
     if not authorization.startswith('Bearer '):
         raise HTTPException(status_code=401, detail="Invalid authentication scheme")
     token = authorization.split(' ')[1]
+    verifier = await require(token_verifier)
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = await verifier.averify(token)
         return decoded_token['uid']
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
@@ -70,53 +162,143 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "llms_available": llm_manager.get_available_llms()}
+    """Liveness: answers as soon as the server is up and never waits for a component to load"""
+    llms = llm_manager.peek()
+    rag = rag_service.peek()
+    verifier = token_verifier.peek()
+    return {
+        "status": "healthy",
+        "llms_available": llms.get_available_llms() if llms else None,
+        "llm_routing": llms.router.snapshot() if llms else None,
+        "query_embedding_cache": rag.query_cache.stats() if rag else None,
+        "chunk_embedding_cache": rag.embedding_cache.stats() if rag else None,
+        "answer_cache": rag.answer_cache.stats() if rag else None,
+        "embedding_server": rag.embedding_server.stats() if rag and rag.embedding_server else None,
+        "auth_token_cache": verifier.stats() if verifier else None
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once every component is loaded, otherwise 503 with each one's state"""
+    ready, states = components.status()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "components": states})
 
-@app.post("/upload", response_model=StatusResponse)
-async def upload_documents(files: List[UploadFile] = File(...), user_id: str = Depends(get_current_user)):
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+UPLOAD_REQUEST_BODY = {
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+        "required": ["files"]
+    }}},
+    "required": True
+}
+
+@app.post("/upload", response_model=UploadJobResponse, status_code=202,
+          openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
+async def upload_documents(request: Request, user_id: str = Depends(get_current_user)):
+    processor = await require(document_processor)
+    queue = await require(ingestion_queue)
+    # The body is parsed here rather than by FastAPI, so limits apply while the bytes stream in
     try:
-        uploaded_files = []
-        
-        for file in files:
-            # Validate file type
-            if not document_processor.is_supported_file(file.filename):
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.filename}")
-            file_path = UPLOAD_DIR / file.filename
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            uploaded_files.append(str(file_path))
-        
-        # Process documents
-        documents = document_processor.process_documents(uploaded_files)
-        rag_service.add_documents(user_id, documents)
-        
-        # Clean up uploaded files (optional)
-        for file_path in uploaded_files:
-            os.remove(file_path)
-        
-        return StatusResponse(
-            status="success",
-            message=f"Successfully processed {len(files)} documents",
-            documents_count=rag_service.get_document_count(user_id)
+        uploads = await receive_uploads(
+            request,
+            field_name="files",
+            max_file_size=Config.MAX_FILE_SIZE,
+            max_files=Config.MAX_FILES_PER_UPLOAD,
+            spool_size=Config.UPLOAD_SPOOL_SIZE,
+            is_allowed=processor.is_supported_file
         )
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Malformed upload: {str(e)}")
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No files provided")
+
+    try:
+        job = queue.submit(user_id, uploads)
+    except IngestionQueueFull as e:
+        for upload in uploads:
+            upload.close()
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
+        for upload in uploads:
+            upload.close()
         raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
+
+    return UploadJobResponse(
+        status="queued",
+        message=f"Accepted {len(uploads)} documents for processing",
+        job_id=job.job_id
+    )
+
+@app.get("/upload/jobs/{job_id}")
+async def get_upload_job(job_id: str, user_id: str = Depends(get_current_user)):
+    job = (await require(ingestion_queue)).get(job_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job.to_dict()
     
     
 @app.post("/ask", response_model=QuestionResponse)
 async def ask_question(request: QuestionRequest, user_id: str = Depends(get_current_user)):
     try:
-        if not rag_service.has_documents(user_id):
+        rag = await require(rag_service)
+        if not await run_in_threadpool(rag.has_documents, user_id):
             raise HTTPException(status_code=400, detail="No documents available. Please upload documents first.")
-        result = rag_service.get_answer(user_id, request.question)
+        result = await rag.aget_answer(user_id, request.question)
         return QuestionResponse(**result)
+    except HTTPException:
+        raise
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"Error generating answer: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating answer: {str(e)}")
     
 
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest, user_id: str = Depends(get_current_user)):
+    rag = await require(rag_service)
+    if not await run_in_threadpool(rag.has_documents, user_id):
+        raise HTTPException(status_code=400, detail="No documents available. Please upload documents first.")
+
+    async def event_stream():
+        try:
+            async for event in rag.astream_answer(user_id, request.question):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        except Exception as e:
+            error = {"detail": f"Error generating answer: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/ask/batch")
+async def ask_questions_batch(request: BatchQuestionRequest, user_id: str = Depends(get_current_user)):
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    if len(request.questions) > Config.MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {Config.MAX_BATCH_QUESTIONS} questions per batch")
+    rag = await require(rag_service)
+
+    async def result_stream():
+        try:
+            async for result in rag.get_answers_batch(user_id, request.questions):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"Error generating answers: {str(e)}"}) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 @app.get("/status", response_model=StatusResponse)
 async def get_status(user_id: str = Depends(get_current_user)):
-    documents_count = rag_service.get_document_count(user_id)
+    documents_count = (await require(rag_service)).get_document_count(user_id)
     return StatusResponse(
         status="ready" if documents_count > 0 else "no_documents",
         message=f"System ready with {documents_count} documents" if documents_count > 0 else "No documents uploaded",
@@ -125,19 +307,24 @@ async def get_status(user_id: str = Depends(get_current_user)):
 
 @app.delete("/documents")
 async def clear_documents(user_id: str = Depends(get_current_user)):
+    rag = await require(rag_service)
     try:
-        rag_service.clear_documents(user_id)
+        rag.clear_documents(user_id)
         return {"status": "success", "message": "All documents cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing documents: {str(e)}")
     
 @app.get("/documents")
 async def list_documents(user_id: str = Depends(get_current_user)):
+    rag = await require(rag_service)
     try:
-        documents = rag_service.get_user_documents(user_id)
+        documents = rag.get_user_documents(user_id)
         return {"documents": documents, "count": len(documents)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
     
+STARTUP_SECONDS.observe(time.perf_counter() - _import_started, phase="import")
+logger.info(f"Imported main in {time.perf_counter() - _import_started:.2f}s")
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
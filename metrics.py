@@ -0,0 +1,215 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """Monotonic counter, e.g. chunks or bytes processed"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of durations in seconds"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts, then sum and count
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Startup
+STARTUP_SECONDS = REGISTRY.histogram(
+    "rag_startup_seconds", "Time to import the app and to initialize each component", ["phase"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+
+# Request path
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_http_request_seconds", "HTTP request latency until the response starts", ["method", "route", "status"])
+AUTH_VERIFY_SECONDS = REGISTRY.histogram(
+    "rag_auth_verify_seconds", "Firebase ID token verification time", ["cache"])
+QUERY_EMBED_SECONDS = REGISTRY.histogram(
+    "rag_query_embed_seconds", "Question embedding time", ["cache"])
+SEARCH_SECONDS = REGISTRY.histogram(
+    "rag_search_seconds", "Collection search time", ["collection", "method"])
+PROMPT_BUILD_SECONDS = REGISTRY.histogram(
+    "rag_prompt_build_seconds", "Context assembly and prompt formatting time")
+LLM_SECONDS = REGISTRY.histogram(
+    "rag_llm_seconds", "LLM call time per provider", ["provider", "outcome"])
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "rag_llm_ttft_seconds", "LLM time to first streamed token per provider", ["provider"])
+
+# Upload path
+PARSE_SECONDS = REGISTRY.histogram(
+    "rag_document_parse_seconds", "Document (or PDF page range) load time", ["extension"])
+SPLIT_SECONDS = REGISTRY.histogram(
+    "rag_document_split_seconds", "Chunk splitting time per document or PDF page range", ["extension"])
+EMBED_BATCH_SECONDS = REGISTRY.histogram(
+    "rag_embed_batch_seconds", "Embedding and writing one batch of chunks")
+DOCUMENT_BYTES = REGISTRY.counter(
+    "rag_document_bytes_total", "Bytes of uploaded documents parsed")
+DOCUMENT_CHUNKS = REGISTRY.counter(
+    "rag_document_chunks_total", "Chunks produced by document splitting")
+EMBEDDED_CHUNKS = REGISTRY.counter(
+    "rag_embedded_chunks_total", "Chunks embedded and written to a collection")
+
+# Embedding server
+EMBED_SERVER_BATCH_TEXTS = REGISTRY.histogram(
+    "rag_embedding_server_batch_texts", "Texts per model call made by the embedding server", ["priority"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+EMBED_SERVER_WAIT_SECONDS = REGISTRY.histogram(
+    "rag_embedding_server_wait_seconds", "Time an embedding request queued before its batch ran", ["priority"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+# Per-request breakdown for the Server-Timing header: a list shared by everything the request runs
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> List[Tuple[str, float]]:
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def record_timing(name: str, seconds: float):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str, histogram: Optional[Histogram] = None, **labels) -> Iterator[None]:
+    """Time a block into a histogram and the current request's timing breakdown"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+        record_timing(name, elapsed)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
@@ -1,77 +1,228 @@
+#!/usr/bin/env python3
+"""
+Build (or resume building) the shared common_knowledge collection from the Indian-Law dataset.
+
+The dataset is streamed rather than loaded into memory, batches are embedded on a pool of
+worker processes while a writer thread upserts finished batches into Chroma, and progress is
+checkpointed after every write so an interrupted run picks up where it stopped.
+
+Usage: python populate_common_knowledge.py [--batch-size 256] [--workers 4] [--restart]
+"""
+
 import os
-from datasets import load_dataset
-from langchain_huggingface import HuggingFaceEmbeddings
-import chromadb
+import json
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the embedding model
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+DATASET_NAME = "vishnun0027/Indian-Law"
+
+# Per-process embedder used by pool workers
+_worker_embeddings = None
+
+
+def _init_worker(backend: str, model_name: str, onnx_file: str, quantize: bool, cache_path: str,
+                 cache_max_entries: int, threads: int):
+    global _worker_embeddings
+    from embedding_backends import create_embeddings
+    from embedding_cache import ChunkEmbeddingCache, CachedEmbeddings
+
+    embeddings, cache_model_name = create_embeddings(backend, model_name, threads=threads, onnx_file=onnx_file,
+                                                     quantize=quantize)
+    cache = ChunkEmbeddingCache(cache_path, max_entries=cache_max_entries)
+    _worker_embeddings = CachedEmbeddings(embeddings, cache, cache_model_name)
 
-# Initialize ChromaDB client
-client = chromadb.PersistentClient(path="./chroma_db")
 
-# Get or create the common knowledge collection
-collection = client.get_or_create_collection(name="common_knowledge")
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    return _worker_embeddings.embed_documents(texts)
 
-# Load the Indian-Law dataset
-logger.info("Loading Indian-Law dataset...")
-dataset = load_dataset("vishnun0027/Indian-Law")
 
-# Verify dataset structure
-logger.info(f"Dataset columns: {dataset['train'].column_names}")
+def new_checkpoint() -> Dict[str, Any]:
+    return {"dataset": DATASET_NAME, "rows_done": 0, "documents_written": 0, "rows_skipped": 0}
 
-# Process the dataset in batches
-batch_size = 100
-total_processed = 0
-total_skipped = 0
 
-for i in range(0, len(dataset['train']), batch_size):
-    logger.info(f"Processing batch {i // batch_size + 1}...")
-    batch = dataset['train'][i:i + batch_size]
-    responses = []
-    instructions = []
-    valid_indices = []
+def load_checkpoint(path: Path) -> Dict[str, Any]:
+    if path.exists():
+        return json.loads(path.read_text())
+    return new_checkpoint()
 
-    # Filter valid entries
-    for j, (resp, instr) in enumerate(zip(batch['Response'], batch['Instruction'])):
+
+def save_checkpoint(path: Path, checkpoint: Dict[str, Any]):
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(checkpoint))
+    os.replace(tmp_path, path)
+
+
+def iter_batches(dataset, start_row: int, batch_size: int):
+    """Yield (end_row, ids, responses, metadatas, skipped) for each batch_size rows of the stream"""
+    row = start_row
+    ids, responses, metadatas = [], [], []
+    skipped = 0
+    for entry in dataset:
+        resp, instr = entry.get('Response'), entry.get('Instruction')
         if isinstance(resp, str) and resp.strip() and isinstance(instr, str) and instr.strip():
+            ids.append(f"common_{row}")
             responses.append(resp)
-            instructions.append(instr)
-            valid_indices.append(j)
+            metadatas.append({'source': 'Indian Law Dataset', 'question': instr})
         else:
-            logger.warning(f"Skipping entry at index {i + j}: Response or Instruction invalid (Response: {resp}, Instruction: {instr})")
-            total_skipped += 1
+            logger.warning(f"Skipping entry at index {row}: Response or Instruction invalid")
+            skipped += 1
+        row += 1
+        if row - start_row >= batch_size:
+            yield row, ids, responses, metadatas, skipped
+            start_row = row
+            ids, responses, metadatas = [], [], []
+            skipped = 0
+    if row > start_row:
+        yield row, ids, responses, metadatas, skipped
 
-    if not responses:
-        logger.info("No valid entries in this batch, skipping...")
-        continue
 
-    # Generate embeddings
-    try:
-        embeddings_batch = embeddings.embed_documents(responses)
-    except Exception as e:
-        logger.error(f"Error embedding batch {i // batch_size + 1}: {e}")
-        continue
+def writer(collection, keyword_index, write_queue: "queue.Queue", checkpoint: Dict[str, Any],
+           checkpoint_path: Path, started_at: float, resumed_documents: int, failed: threading.Event):
+    """Upsert embedded batches (and their keyword index rows) in order and checkpoint after each write
+
+    On a write error, sets failed so the reader stops submitting work.
+    """
+    while True:
+        item = write_queue.get()
+        if item is None:
+            return
+        if failed.is_set():
+            continue  # Keep draining so the reader never blocks; the checkpoint stays at the last good write
+        end_row, ids, responses, metadatas, skipped, vectors = item
+        try:
+            if ids:
+                collection.upsert(ids=ids, documents=responses, embeddings=vectors, metadatas=metadatas)
+                keyword_index.add(collection.name, ids, responses, metadatas)
+        except Exception as e:
+            logger.error(f"Error writing rows up to {end_row} to ChromaDB: {e}")
+            checkpoint["error"] = str(e)
+            failed.set()
+            continue
+        checkpoint["rows_done"] = end_row
+        checkpoint["documents_written"] += len(ids)
+        checkpoint["rows_skipped"] += skipped
+        save_checkpoint(checkpoint_path, checkpoint)
+
+        written = checkpoint["documents_written"] - resumed_documents
+        rate = written / (time.perf_counter() - started_at)
+        logger.info(f"Wrote rows up to {end_row}: {checkpoint['documents_written']} documents "
+                    f"({rate:.1f} docs/s)")
 
-    # Prepare metadata and IDs
-    metadatas = [{'source': 'Indian Law Dataset', 'question': instr} for instr in instructions]
-    ids = [f"common_{i + j}" for j in valid_indices]
 
-    # Insert into ChromaDB
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=256, help="Rows embedded per batch")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Embedding worker processes")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="Embedding threads per worker (default: CPU count / workers)")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default=os.getenv("EMBEDDING_BACKEND", "torch"),
+                        help="Embedding backend (default: EMBEDDING_BACKEND or torch)")
+    parser.add_argument("--max-pending", type=int, default=0,
+                        help="Batches in flight before the reader waits (default: 2 x workers)")
+    parser.add_argument("--checkpoint", default=str(Path(CHROMA_DB_PATH) / "common_knowledge.checkpoint.json"))
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and start from row 0")
+    parser.add_argument("--no-index", action="store_true", help="Skip building the memory-mapped common index")
+    parser.add_argument("--quantize", choices=["int8"], default=None, help="Quantize the common index vectors")
+    args = parser.parse_args()
+
+    import chromadb
+    from datasets import load_dataset
+    from keyword_index import KeywordIndex
+
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    max_pending = args.max_pending or 2 * args.workers
+    model_name = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    onnx_file = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx")
+    quantize_embeddings = os.getenv("EMBEDDING_QUANTIZE", "False").lower() == "true"
+    cache_path = os.getenv("EMBEDDING_CACHE_PATH", str(Path(CHROMA_DB_PATH) / "embedding_cache.sqlite3"))
+    cache_max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1_000_000))
+
+    checkpoint_path = Path(args.checkpoint)
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    checkpoint = new_checkpoint() if args.restart else load_checkpoint(checkpoint_path)
+    start_row = checkpoint["rows_done"]
+
+    # Initialize ChromaDB client and the common knowledge collection
+    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    collection = client.get_or_create_collection(name="common_knowledge")
+    keyword_index = KeywordIndex(os.getenv("KEYWORD_INDEX_PATH", str(Path(CHROMA_DB_PATH) / "keyword_index.sqlite3")))
+    if start_row and not keyword_index.has_collection(collection.name):
+        # Resuming a run that started before the keyword index existed: index what is already written
+        keyword_index.rebuild(collection.name, collection)
+
+    # Stream the Indian-Law dataset, skipping rows already written
+    logger.info(f"Streaming {DATASET_NAME} from row {start_row}...")
+    dataset = load_dataset(DATASET_NAME, split="train", streaming=True)
+    if start_row:
+        dataset = dataset.skip(start_row)
+
+    started_at = time.perf_counter()
+    write_queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+    write_failed = threading.Event()
+    writer_thread = threading.Thread(
+        target=writer,
+        args=(collection, keyword_index, write_queue, checkpoint, checkpoint_path, started_at,
+              checkpoint["documents_written"], write_failed),
+        daemon=True
+    )
+    writer_thread.start()
+
+    executor = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.backend, model_name, onnx_file, quantize_embeddings, cache_path, cache_max_entries, threads)
+    )
+    logger.info(f"Embedding with {args.workers} {args.backend} workers x {threads} threads, "
+                f"batch size {args.batch_size}")
+
+    # Keep batches in submission order so checkpoints always cover a contiguous prefix of rows
+    pending = deque()
     try:
-        collection.add(
-            documents=responses,
-            embeddings=embeddings_batch,
-            metadatas=metadatas,
-            ids=ids
-        )
-        total_processed += len(responses)
-        logger.info(f"Added {len(responses)} documents to common_knowledge collection.")
-    except Exception as e:
-        logger.error(f"Error adding batch {i // batch_size + 1} to ChromaDB: {e}")
-
-logger.info(f"Completed. Total documents processed: {total_processed}, Total skipped: {total_skipped}")
\ No newline at end of file
+        for end_row, ids, responses, metadatas, skipped in iter_batches(dataset, start_row, args.batch_size):
+            if write_failed.is_set():
+                logger.error("Stopping after a write error")
+                break
+            future = executor.submit(_embed_batch, responses) if responses else None
+            pending.append((future, end_row, ids, responses, metadatas, skipped))
+            while len(pending) >= max_pending:
+                future, *batch = pending.popleft()
+                write_queue.put((*batch, future.result() if future else []))
+        while pending and not write_failed.is_set():
+            future, *batch = pending.popleft()
+            write_queue.put((*batch, future.result() if future else []))
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+        executor.shutdown(cancel_futures=True)
+
+    if checkpoint.get("error"):
+        raise SystemExit(f"Stopped after a write error; rerun to resume from row {checkpoint['rows_done']}")
+
+    elapsed = time.perf_counter() - started_at
+    written = checkpoint["documents_written"]
+    logger.info(f"Completed. Total documents processed: {written}, Total skipped: {checkpoint['rows_skipped']}, "
+                f"{elapsed:.0f}s this run")
+
+    if not args.no_index:
+        from common_index import CommonKnowledgeIndex
+        index_path = os.getenv("COMMON_INDEX_PATH", str(Path(CHROMA_DB_PATH) / "common_index"))
+        CommonKnowledgeIndex.build(collection, index_path, quantize=args.quantize)
+
+
+if __name__ == "__main__":
+    main()
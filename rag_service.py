@@ -1,22 +1,99 @@
-from typing import List, Dict, Any
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable, List, Dict, Any, Optional, Tuple
 import logging
 from langchain.schema import Document
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.prompts import PromptTemplate
 from llm_manager import LLMManager
+from config import Config
+from vector_store_registry import VectorStoreRegistry, COMMON_COLLECTION_NAME
+from embedding_cache import QueryEmbeddingCache, ChunkEmbeddingCache, CachedEmbeddings
+from embedding_backends import create_embeddings
+from embedding_server import EmbeddingServer
+from source_manifest import SourceManifest
+from document_processor import compute_chunk_id
+from answer_cache import AnswerCache
+from common_index import CommonKnowledgeIndex
+from keyword_index import KeywordIndex
+from context_builder import ContextBuilder
+from metrics import (
+    EMBED_BATCH_SECONDS, EMBEDDED_CHUNKS, PROMPT_BUILD_SECONDS, QUERY_EMBED_SECONDS, SEARCH_SECONDS,
+    record_timing, stage
+)
 
 logger = logging.getLogger(__name__)
 
 class RAGService:
     def __init__(self, llm_manager: LLMManager):
         self.llm_manager = llm_manager
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
+        self.embedding_cache = ChunkEmbeddingCache(
+            Config.EMBEDDING_CACHE_PATH,
+            max_entries=Config.EMBEDDING_CACHE_MAX_ENTRIES
+        )
+        base_embeddings, cache_model_name = create_embeddings(
+            Config.EMBEDDING_BACKEND,
+            Config.EMBEDDING_MODEL,
+            threads=Config.EMBEDDING_THREADS,
+            batch_size=Config.EMBEDDING_BATCH_SIZE,
+            max_batch_tokens=Config.EMBEDDING_MAX_BATCH_TOKENS,
+            onnx_file=Config.EMBEDDING_ONNX_FILE,
+            quantize=Config.EMBEDDING_QUANTIZE
+        )
+        self.embedding_server: Optional[EmbeddingServer] = None
+        if Config.EMBEDDING_SERVER_ENABLED:
+            # Questions and upload chunks from concurrent requests share model calls
+            self.embedding_server = EmbeddingServer(
+                base_embeddings,
+                max_batch_size=Config.EMBEDDING_BATCH_SIZE,
+                bulk_batch_size=Config.EMBEDDING_BULK_BATCH_SIZE,
+                batch_window=Config.EMBEDDING_BATCH_WINDOW_MS / 1000
+            )
+            self.embedding_server.start()
+            base_embeddings = self.embedding_server
+        self.embeddings = CachedEmbeddings(base_embeddings, self.embedding_cache, model_name=cache_model_name)
+        self.vector_stores = VectorStoreRegistry(
+            self.embeddings,
+            persist_directory=Config.CHROMA_DB_PATH,
+            max_user_stores=Config.VECTOR_STORE_CACHE_SIZE
+        )
+        self.query_cache = QueryEmbeddingCache(
+            max_entries=Config.QUERY_EMBEDDING_CACHE_SIZE,
+            ttl_seconds=Config.QUERY_EMBEDDING_CACHE_TTL
+        )
+        self.manifest = SourceManifest(Config.SOURCE_MANIFEST_PATH)
+        self.common_index = CommonKnowledgeIndex.open_if_exists(Config.COMMON_INDEX_PATH, nprobe=Config.COMMON_INDEX_NPROBE)
+        self.keyword_index = KeywordIndex(Config.KEYWORD_INDEX_PATH)
+        if Config.HYBRID_SEARCH_ENABLED and not self.keyword_index.has_collection(COMMON_COLLECTION_NAME):
+            logger.warning("No keyword index for common_knowledge, run `python keyword_index.py build` to add one")
+        self.answer_cache = AnswerCache(
+            max_entries=Config.ANSWER_CACHE_SIZE,
+            ttl_seconds=Config.ANSWER_CACHE_TTL,
+            semantic_enabled=Config.ANSWER_CACHE_SEMANTIC,
+            semantic_threshold=Config.ANSWER_CACHE_SEMANTIC_THRESHOLD,
+            context_overlap=Config.ANSWER_CACHE_CONTEXT_OVERLAP
+        )
+        self._retrieval_executor = ThreadPoolExecutor(
+            max_workers=Config.RETRIEVAL_WORKERS,
+            thread_name_prefix="retrieval"
+        )
+        # Common searches get their own threads: one that times out keeps running, and must not hold
+        # up user searches. Once every common thread is busy, new common searches are skipped
+        self._common_executor = ThreadPoolExecutor(
+            max_workers=Config.COMMON_SEARCH_WORKERS,
+            thread_name_prefix="common-search"
+        )
+        self._common_slots = threading.BoundedSemaphore(Config.COMMON_SEARCH_WORKERS)
+        self.context_builder = ContextBuilder(
+            token_budget=Config.CONTEXT_TOKEN_BUDGET,
+            dedup_threshold=Config.CONTEXT_DEDUP_THRESHOLD,
+            model=Config.CONTEXT_TOKENIZER_MODEL
         )
         self.prompt_template = self._create_prompt_template()
-        logger.info("RAGService initialized with HuggingFace embeddings")
+        logger.info(f"RAGService initialized with {Config.EMBEDDING_BACKEND} embeddings")
 
     def _create_prompt_template(self):
         template = """You are a helpful AI assistant that answers questions based on the provided context.
@@ -35,76 +112,569 @@ Instructions:
 Answer:"""
         return PromptTemplate(template=template, input_variables=["context", "question"])
 
-    def _get_vector_store(self, user_id: str):
-        collection_name = f"user_{user_id}"
-        return Chroma(
-            collection_name=collection_name,
-            embedding_function=self.embeddings,
-            persist_directory="./chroma_db"
-        )
+    def _get_vector_store(self, user_id: str) -> Chroma:
+        return self.vector_stores.get_user_store(user_id)
 
-    def _get_common_vector_store(self):
-        return Chroma(
-            collection_name="common_knowledge",
-            embedding_function=self.embeddings,
-            persist_directory="./chroma_db"
-        )
+    def _get_common_vector_store(self) -> Chroma:
+        return self.vector_stores.get_common_store()
+
+    def embed_query(self, question: str) -> List[float]:
+        """Embed a question once, reusing cached vectors for repeated questions"""
+        start = time.perf_counter()
+        vector = self.query_cache.get(question)
+        if vector is None:
+            vector = self.embeddings.embed_query(question)
+            self.query_cache.put(question, vector)
+            self._record_query_embed(start, "miss")
+        else:
+            self._record_query_embed(start, "hit")
+        return vector
+
+    async def aembed_query(self, question: str) -> List[float]:
+        """Embed a question from a coroutine, awaiting the embedding server's batch on a cache miss"""
+        if self.embedding_server is None:
+            return await self._run_in_executor(self.embed_query, question)
+        start = time.perf_counter()
+        vector = self.query_cache.get(question)
+        if vector is None:
+            vector = await self.embedding_server.aembed_query(question)
+            self.query_cache.put(question, vector)
+            self._record_query_embed(start, "miss")
+        else:
+            self._record_query_embed(start, "hit")
+        return vector
+
+    @staticmethod
+    def _record_query_embed(start: float, cache: str):
+        elapsed = time.perf_counter() - start
+        QUERY_EMBED_SECONDS.observe(elapsed, cache=cache)
+        record_timing("embed", elapsed)
 
-    def add_documents(self, user_id: str, documents: List[Document]):
+    def embed_queries(self, questions: List[str]) -> List[List[float]]:
+        """Embed many questions, running the model once for all cache misses"""
+        vectors: List[Optional[List[float]]] = [self.query_cache.get(question) for question in questions]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_queries([questions[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                self.query_cache.put(questions[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def is_unchanged(self, user_id: str, source: str, file_hash: str) -> bool:
+        """Check whether this exact file is already stored for the user under the same source name"""
+        self._ensure_manifest(user_id)
+        return self.manifest.get_file_hash(user_id, source) == file_hash
+
+    def add_documents(self, user_id: str, documents: List[Document],
+                      progress_callback: Optional[Callable[[int], None]] = None):
+        """Store chunks, skipping ones already embedded and replacing stale chunks of changed files"""
         try:
             if not documents:
                 logger.warning("No documents provided to add")
                 return
-            vector_store = self._get_vector_store(user_id)
-            vector_store.add_documents(documents)
-            logger.info(f"Added {len(documents)} documents for user {user_id}")
+            self._ensure_manifest(user_id)
+            self._ensure_keyword_index(user_id)
+
+            by_source: Dict[str, List[Document]] = {}
+            for doc in documents:
+                by_source.setdefault(doc.metadata.get('source', 'Unknown'), []).append(doc)
+
+            added = 0
+            for source, source_docs in by_source.items():
+                file_hash = source_docs[0].metadata.get('file_hash')
+                if file_hash and self.manifest.get_file_hash(user_id, source) == file_hash:
+                    logger.info(f"Skipping unchanged {source} for user {user_id}")
+                    if progress_callback:
+                        progress_callback(len(source_docs))
+                    continue
+                added += self._add_source_chunks(user_id, source, source_docs, file_hash, progress_callback)
+
+            logger.info(f"Added {added} of {len(documents)} documents for user {user_id} "
+                        f"({len(documents) - added} already stored)")
         except Exception as e:
             logger.error(f"Error adding documents: {e}")
             raise
 
-    def get_answer(self, user_id: str, question: str, k: int = 4) -> Dict[str, Any]:
+    def add_document_stream(self, user_id: str, source: str, file_hash: Optional[str], chunks: Iterable[Document],
+                            progress_callback: Optional[Callable[[int], None]] = None) -> int:
+        """Store one file's chunks as they are produced, writing every EMBED_BATCH_SIZE batch immediately
+
+        Memory stays bounded by the batch size however large the file is, and the first batches
+        are searchable while the rest of the file is still being parsed. Returns chunks added.
+        """
         try:
-            # Get vector stores
-            user_vector_store = self._get_vector_store(user_id)
-            common_vector_store = self._get_common_vector_store()
+            self._ensure_manifest(user_id)
+            self._ensure_keyword_index(user_id)
+            if file_hash and self.manifest.get_file_hash(user_id, source) == file_hash:
+                logger.info(f"Skipping unchanged {source} for user {user_id}")
+                return 0
+            added = self._add_source_chunks(user_id, source, chunks, file_hash, progress_callback)
+            logger.info(f"Added {added} chunks of {source} for user {user_id}")
+            return added
+        except Exception as e:
+            logger.error(f"Error adding documents: {e}")
+            raise
 
-            # Retrieve documents with scores
-            user_docs_with_scores = user_vector_store.similarity_search_with_score(question, k=k)
-            common_docs_with_scores = common_vector_store.similarity_search_with_score(question, k=k)
+    def _add_source_chunks(self, user_id: str, source: str, chunks: Iterable[Document], file_hash: Optional[str],
+                           progress_callback: Optional[Callable[[int], None]] = None) -> int:
+        """Embed and write one source's chunks in batches, then drop chunks its previous version had"""
+        vector_store = self._get_vector_store(user_id)
+        collection_name = self._user_collection_name(user_id)
+        seen_ids = set()
+        batch: List[Document] = []
+        added = 0
+        size = 0
+        file_size = None
 
-            # Combine and sort by score (lower distance = more similar)
-            all_docs_with_scores = user_docs_with_scores + common_docs_with_scores
-            if not all_docs_with_scores:
-                return {"answer": "Nothing relevant found.", "sources": [], "llm_used": "none"}
+        def write_batch() -> int:
+            ids = [doc.metadata['chunk_id'] for doc in batch]
+            existing = set(vector_store._collection.get(ids=ids, include=[])['ids'])
+            new_docs = [doc for doc in batch if doc.metadata['chunk_id'] not in existing]
+            if new_docs:
+                new_ids = [doc.metadata['chunk_id'] for doc in new_docs]
+                with EMBED_BATCH_SECONDS.time():
+                    vector_store.add_documents(new_docs, ids=new_ids)
+                    self.keyword_index.add(collection_name, new_ids, [doc.page_content for doc in new_docs],
+                                           [doc.metadata for doc in new_docs])
+                EMBEDDED_CHUNKS.inc(len(new_docs))
+                # The new chunks are searchable now, so answers cached without them are stale
+                self.answer_cache.invalidate_scope(f"user:{user_id}")
+            if progress_callback:
+                progress_callback(len(batch))
+            batch.clear()
+            return len(new_docs)
 
-            all_docs_with_scores.sort(key=lambda x: x[1])  # Ascending for cosine distance
-            top_k_docs_with_scores = all_docs_with_scores[:k]
+        for i, doc in enumerate(chunks):
+            chunk_id = doc.metadata.get('chunk_id') or compute_chunk_id(source, i, doc.page_content)
+            if chunk_id in seen_ids:
+                continue
+            seen_ids.add(chunk_id)
+            doc.metadata['chunk_id'] = chunk_id
+            file_size = file_size or doc.metadata.get('file_size')
+            size += len(doc.page_content.encode('utf-8'))
+            batch.append(doc)
+            if len(batch) >= Config.EMBED_BATCH_SIZE:
+                added += write_batch()
+        if batch:
+            added += write_batch()
 
-            # Extract documents and build context
-            top_k_docs = [doc for doc, score in top_k_docs_with_scores]
-            if not top_k_docs:
-                return {"answer": "Nothing relevant found.", "sources": [], "llm_used": "none"}
+        size = int(file_size or size)
+        if file_hash:
+            # Upsert: drop chunks of the previous version that the new file no longer has
+            stored = vector_store._collection.get(where={'source': source}, include=[])['ids']
+            stale = list(set(stored) - seen_ids)
+            if stale:
+                vector_store._collection.delete(ids=stale)
+                self.keyword_index.delete(collection_name, stale)
+                self.answer_cache.invalidate_scope(f"user:{user_id}")
+            self.manifest.record_source(user_id, source, len(seen_ids), size, file_hash)
+        else:
+            self.manifest.record_source(user_id, source, added, size, replace=False)
+        return added
 
-            context = "\n\n".join([doc.page_content for doc in top_k_docs])
+    def _search_user(self, user_id: str, query_vector: List[float], k: int) -> List[Tuple[Document, float]]:
+        vector_store = self._get_vector_store(user_id)
+        with stage("search_user_vector", SEARCH_SECONDS, collection="user", method="vector"):
+            results = vector_store.similarity_search_by_vector_with_relevance_scores(query_vector, k=k)
+        for doc, _ in results:
+            doc.metadata['collection'] = 'user'
+        return results
 
-            # Collect sources
-            sources = set([doc.metadata.get('source', 'Unknown') for doc in top_k_docs])
+    def _search_common(self, query_vector: List[float], k: int) -> List[Tuple[Document, float]]:
+        with stage("search_common_vector", SEARCH_SECONDS, collection="common", method="vector"):
+            if self.common_index is not None:
+                return self.common_index.search(query_vector, k=k)
+            vector_store = self._get_common_vector_store()
+            results = vector_store.similarity_search_by_vector_with_relevance_scores(query_vector, k=k)
+        for doc, _ in results:
+            doc.metadata['collection'] = 'common'
+        return results
 
-            # Generate answer
-            llm, llm_name = self.llm_manager.get_random_llm()
+    @staticmethod
+    def _user_collection_name(user_id: str) -> str:
+        return f"user_{user_id}"
+
+    def _ensure_keyword_index(self, user_id: str):
+        """Backfill a user's keyword index once from their collection if it predates hybrid search"""
+        collection_name = self._user_collection_name(user_id)
+        if self.keyword_index.has_collection(collection_name):
+            return
+        vector_store = self._get_vector_store(user_id)
+        self.keyword_index.rebuild(collection_name, vector_store._collection)
+
+    def _keyword_search_user(self, user_id: str, question: str, k: int) -> List[Tuple[Document, float]]:
+        self._ensure_keyword_index(user_id)
+        with stage("search_user_keyword", SEARCH_SECONDS, collection="user", method="keyword"):
+            results = self.keyword_index.search(self._user_collection_name(user_id), question, k)
+        for doc, _ in results:
+            doc.metadata['collection'] = 'user'
+        return results
+
+    def _keyword_search_common(self, question: str, k: int) -> List[Tuple[Document, float]]:
+        with stage("search_common_keyword", SEARCH_SECONDS, collection="common", method="keyword"):
+            results = self.keyword_index.search(COMMON_COLLECTION_NAME, question, k)
+        for doc, _ in results:
+            doc.metadata['collection'] = 'common'
+        return results
+
+    @staticmethod
+    def _candidates(k: int) -> int:
+        return max(k, Config.RETRIEVAL_CANDIDATES)
+
+    def _merge_results(self, ranked_lists: List[List[Tuple[Document, float]]], k: int) -> List[Document]:
+        """Fuse ranked result lists with reciprocal rank fusion, honouring per-collection quotas
+
+        Only ranks are used, so vector distances and BM25 scores from different collections
+        never have to be compared with each other.
+        """
+        scores: Dict[Tuple[str, str], float] = {}
+        documents: Dict[Tuple[str, str], Document] = {}
+        for results in ranked_lists:
+            for rank, (doc, _) in enumerate(results, start=1):
+                key = (doc.metadata.get('collection', 'user'), self._chunk_key(doc))
+                scores[key] = scores.get(key, 0.0) + 1.0 / (Config.RRF_K + rank)
+                documents.setdefault(key, doc)
+
+        quotas = {'user': Config.USER_RESULTS_QUOTA, 'common': Config.COMMON_RESULTS_QUOTA}
+        counts: Dict[str, int] = {}
+        selected, overflow = [], []
+        for key in sorted(scores, key=scores.get, reverse=True):
+            if len(selected) == k:
+                break
+            quota = quotas.get(key[0])
+            if quota and counts.get(key[0], 0) >= quota:
+                overflow.append(key)
+                continue
+            counts[key[0]] = counts.get(key[0], 0) + 1
+            selected.append(key)
+        # Quotas only make room for the other collection; slots it cannot fill go back in rank order
+        selected += overflow[:k - len(selected)]
+        selected.sort(key=scores.get, reverse=True)
+        return [documents[key] for key in selected]
+
+    @staticmethod
+    def _query_results_to_docs(results: Dict[str, Any], collection: str) -> List[List[Tuple[Document, float]]]:
+        batch = []
+        for ids, texts, metadatas, distances in zip(results['ids'], results['documents'],
+                                                    results['metadatas'], results['distances']):
+            batch.append([
+                (Document(page_content=text or "", metadata={**(metadata or {}), 'chunk_id': chunk_id,
+                                                             'collection': collection}), distance)
+                for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)
+            ])
+        return batch
+
+    def _search_user_batch(self, user_id: str, query_vectors: List[List[float]], k: int) -> List[List[Tuple[Document, float]]]:
+        vector_store = self._get_vector_store(user_id)
+        if vector_store._collection.count() == 0:
+            return [[] for _ in query_vectors]
+        with stage("search_user_vector", SEARCH_SECONDS, collection="user", method="vector"):
+            results = vector_store._collection.query(query_embeddings=query_vectors, n_results=k,
+                                                     include=['documents', 'metadatas', 'distances'])
+        return self._query_results_to_docs(results, 'user')
+
+    def _search_common_batch(self, query_vectors: List[List[float]], k: int) -> List[List[Tuple[Document, float]]]:
+        with stage("search_common_vector", SEARCH_SECONDS, collection="common", method="vector"):
+            if self.common_index is not None:
+                return [self.common_index.search(query_vector, k=k) for query_vector in query_vectors]
+            vector_store = self._get_common_vector_store()
+            if vector_store._collection.count() == 0:
+                return [[] for _ in query_vectors]
+            results = vector_store._collection.query(query_embeddings=query_vectors, n_results=k,
+                                                     include=['documents', 'metadatas', 'distances'])
+        return self._query_results_to_docs(results, 'common')
+
+    def _keyword_search_user_batch(self, user_id: str, questions: List[str], k: int) -> List[List[Tuple[Document, float]]]:
+        return [self._keyword_search_user(user_id, question, k) for question in questions]
+
+    def _keyword_search_common_batch(self, questions: List[str], k: int) -> List[List[Tuple[Document, float]]]:
+        return [self._keyword_search_common(question, k) for question in questions]
+
+    def retrieve(self, user_id: str, question: str, k: int = 4) -> List[Document]:
+        """Retrieve the top-k chunks across the user and common collections"""
+        # Embed the question once and search both collections with the same vector
+        query_vector = self.embed_query(question)
+        candidates = self._candidates(k)
+        ranked_lists = [self._search_user(user_id, query_vector, candidates),
+                        self._search_common(query_vector, candidates)]
+        if Config.HYBRID_SEARCH_ENABLED:
+            ranked_lists += [self._keyword_search_user(user_id, question, candidates),
+                             self._keyword_search_common(question, candidates)]
+        return self._merge_results(ranked_lists, k)
+
+    def _run_in_executor(self, func, *args) -> asyncio.Future:
+        # Run in the request's context so stage timings reach its Server-Timing header
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(self._retrieval_executor, context.run, func, *args)
+
+    async def _search_with_timeout(self, label: str, func, *args, timeout: float) -> List[Tuple[Document, float]]:
+        try:
+            return await asyncio.wait_for(self._run_in_executor(func, *args), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{label} search timed out after {timeout}s, continuing without it")
+            return []
+
+    def _submit_common(self, func, *args) -> Optional[Future]:
+        """Start a search on the common executor, or return None if all its threads are busy"""
+        if not self._common_slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._common_executor.submit(contextvars.copy_context().run, func, *args)
+        except Exception:
+            self._common_slots.release()
+            raise
+        # Released when the search finishes, or is cancelled before it starts, not when its caller stops waiting
+        future.add_done_callback(lambda _: self._common_slots.release())
+        return future
+
+    async def _search_common_with_timeout(self, label: str, func, *args,
+                                          timeout: float) -> List[Tuple[Document, float]]:
+        """Like _search_with_timeout on the common executor, skipping the search if all its threads are busy"""
+        future = self._submit_common(func, *args)
+        if future is None:
+            logger.warning(f"{label} search skipped, {Config.COMMON_SEARCH_WORKERS} common searches still running")
+            return []
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{label} search timed out after {timeout}s, continuing without it")
+            return []
+
+    async def aretrieve(self, user_id: str, question: str, k: int = 4) -> List[Document]:
+        """Retrieve off the event loop, searching both collections concurrently"""
+        candidates = self._candidates(k)
+
+        async def vector_searches():
+            query_vector = await self.aembed_query(question)
+            return await asyncio.gather(
+                self._search_with_timeout("User collection", self._search_user, user_id, query_vector, candidates,
+                                          timeout=Config.USER_SEARCH_TIMEOUT),
+                self._search_common_with_timeout("Common collection", self._search_common, query_vector, candidates,
+                                                 timeout=Config.COMMON_SEARCH_TIMEOUT)
+            )
+
+        # Keyword searches don't need the embedding, so they run while it is computed
+        searches = [vector_searches()]
+        if Config.HYBRID_SEARCH_ENABLED:
+            searches.append(asyncio.gather(
+                self._search_with_timeout("User keyword", self._keyword_search_user, user_id, question, candidates,
+                                          timeout=Config.USER_SEARCH_TIMEOUT),
+                self._search_common_with_timeout("Common keyword", self._keyword_search_common, question, candidates,
+                                                 timeout=Config.COMMON_SEARCH_TIMEOUT)
+            ))
+        groups = await asyncio.gather(*searches)
+        return self._merge_results([results for group in groups for results in group], k)
+
+    @staticmethod
+    def _answer_scope(user_id: str, documents: List[Document]) -> str:
+        # Answers that used any of the user's own chunks are only ever reused for that user
+        if any(doc.metadata.get('collection') != 'common' for doc in documents):
+            return f"user:{user_id}"
+        return "common"
+
+    @staticmethod
+    def _chunk_key(doc: Document) -> str:
+        return getattr(doc, 'id', None) or doc.metadata.get('chunk_id') or compute_chunk_id(
+            doc.metadata.get('source', 'Unknown'), 0, doc.page_content)
+
+    def _cache_lookup(self, user_id: str, question: str, documents: List[Document],
+                      query_vector: Optional[List[float]] = None) -> Tuple[Optional[Dict[str, Any]], tuple]:
+        """Look up a cached answer; also returns the cache key parts for storing a fresh one"""
+        scope = self._answer_scope(user_id, documents)
+        chunk_ids = [self._chunk_key(doc) for doc in documents]
+        if not self.answer_cache.semantic_enabled:
+            query_vector = None
+        elif query_vector is None:
+            query_vector = self.embed_query(question)
+        cached = self.answer_cache.get(scope, question, chunk_ids, query_vector)
+        return cached, (scope, question, chunk_ids, query_vector)
+
+    async def _acache_lookup(self, user_id: str, question: str,
+                             documents: List[Document]) -> Tuple[Optional[Dict[str, Any]], tuple]:
+        """Like _cache_lookup, awaiting the question vector instead of embedding it on the event loop"""
+        query_vector = await self.aembed_query(question) if self.answer_cache.semantic_enabled else None
+        return self._cache_lookup(user_id, question, documents, query_vector)
+
+    def _cache_store(self, key_parts: tuple, result: Dict[str, Any]):
+        scope, question, chunk_ids, query_vector = key_parts
+        self.answer_cache.put(scope, question, chunk_ids, result, query_vector)
+
+    def _build_prompt(self, question: str, documents: List[Document]) -> Tuple[str, List[str]]:
+        with stage("prompt", PROMPT_BUILD_SECONDS):
+            context, used_documents = self.context_builder.build(documents)
+
+            # Collect sources of the chunks that made it into the context
+            sources = set([doc.metadata.get('source', 'Unknown') for doc in used_documents])
             prompt = self.prompt_template.format(context=context, question=question)
-            response = llm.invoke(prompt)
-            answer_text = response.content if hasattr(response, 'content') else str(response)
+        return prompt, list(sources)
+
+    def answer_from_documents(self, question: str, documents: List[Document]) -> Dict[str, Any]:
+        """Generate an answer from already retrieved chunks"""
+        try:
+            if not documents:
+                return {"answer": "Nothing relevant found.", "sources": [], "llm_used": "none"}
+
+            prompt, sources = self._build_prompt(question, documents)
+
+            # Generate answer
+            _, llm_name = self.llm_manager.get_random_llm()
+            with stage("llm"):
+                answer_text = self.llm_manager.invoke(llm_name, prompt)
 
             return {
                 "answer": answer_text,
-                "sources": list(sources),
+                "sources": sources,
                 "llm_used": llm_name
             }
         except Exception as e:
             logger.error(f"Error generating answer: {e}")
             raise
 
+    def get_answer(self, user_id: str, question: str, k: int = 4) -> Dict[str, Any]:
+        try:
+            documents = self.retrieve(user_id, question, k)
+            if not documents:
+                return self.answer_from_documents(question, documents)
+            cached, key_parts = self._cache_lookup(user_id, question, documents)
+            if cached is not None:
+                return cached
+            result = self.answer_from_documents(question, documents)
+            self._cache_store(key_parts, result)
+            return result
+        except Exception as e:
+            logger.error(f"Error generating answer: {e}")
+            raise
+
+    async def aget_answer(self, user_id: str, question: str, k: int = 4) -> Dict[str, Any]:
+        """Async answer path: concurrent retrieval plus a native async LLM call"""
+        try:
+            documents = await self.aretrieve(user_id, question, k)
+            if not documents:
+                return {"answer": "Nothing relevant found.", "sources": [], "llm_used": "none"}
+
+            cached, key_parts = await self._acache_lookup(user_id, question, documents)
+            if cached is not None:
+                return cached
+
+            prompt, sources = self._build_prompt(question, documents)
+            with stage("llm"):
+                answer_text, llm_name = await self.llm_manager.ainvoke_hedged(prompt)
+
+            result = {
+                "answer": answer_text,
+                "sources": sources,
+                "llm_used": llm_name
+            }
+            self._cache_store(key_parts, result)
+            return result
+        except Exception as e:
+            logger.error(f"Error generating answer: {e}")
+            raise
+
+    async def astream_answer(self, user_id: str, question: str, k: int = 4) -> AsyncIterator[Dict[str, Any]]:
+        """Stream an answer as events: sources first, then tokens, then a done trailer with timings"""
+        start = time.perf_counter()
+        documents = await self.aretrieve(user_id, question, k)
+        if not documents:
+            yield {"event": "sources", "data": {"sources": [], "llm_used": "none"}}
+            yield {"event": "token", "data": {"text": "Nothing relevant found."}}
+            yield {"event": "done", "data": {"llm_used": "none", "ttft_ms": None,
+                                             "total_ms": (time.perf_counter() - start) * 1000}}
+            return
+
+        cached, key_parts = await self._acache_lookup(user_id, question, documents)
+        if cached is not None:
+            yield {"event": "sources", "data": {"sources": cached["sources"], "llm_used": cached["llm_used"]}}
+            yield {"event": "token", "data": {"text": cached["answer"]}}
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            yield {"event": "done", "data": {"llm_used": cached["llm_used"], "ttft_ms": elapsed_ms,
+                                             "total_ms": elapsed_ms, "cached": True}}
+            return
+
+        prompt, sources = self._build_prompt(question, documents)
+        _, llm_name = self.llm_manager.get_random_llm()
+        yield {"event": "sources", "data": {"sources": sources, "llm_used": llm_name}}
+
+        ttft_ms = None
+        tokens = []
+        async for text in self.llm_manager.astream(llm_name, prompt):
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - start) * 1000
+            tokens.append(text)
+            yield {"event": "token", "data": {"text": text}}
+        self._cache_store(key_parts, {"answer": "".join(tokens), "sources": sources, "llm_used": llm_name})
+
+        total_ms = (time.perf_counter() - start) * 1000
+        ttft_label = f"{ttft_ms:.0f}ms" if ttft_ms is not None else "n/a"
+        logger.info(f"Streamed answer from {llm_name}: ttft={ttft_label} total={total_ms:.0f}ms")
+        yield {"event": "done", "data": {"llm_used": llm_name, "ttft_ms": ttft_ms, "total_ms": total_ms}}
+
+    async def get_answers_batch(self, user_id: str, questions: List[str], k: int = 4) -> AsyncIterator[Dict[str, Any]]:
+        """Answer many questions at once, yielding each result as soon as it is ready
+
+        All questions are embedded in one model call and each collection is queried once with
+        the whole batch of vectors; LLM calls then run with at most BATCH_LLM_CONCURRENCY in flight.
+        """
+        candidates = self._candidates(k)
+        no_results = [[] for _ in questions]
+
+        async def keyword_searches():
+            if not Config.HYBRID_SEARCH_ENABLED:
+                return no_results, no_results
+            return await asyncio.gather(
+                self._search_with_timeout("User keyword batch", self._keyword_search_user_batch, user_id, questions,
+                                          candidates, timeout=Config.USER_SEARCH_TIMEOUT),
+                self._search_common_with_timeout("Common keyword batch", self._keyword_search_common_batch, questions,
+                                                 candidates, timeout=Config.COMMON_SEARCH_TIMEOUT)
+            )
+
+        # Keyword searches don't need the embeddings, so they run while those are computed
+        keyword_task = asyncio.create_task(keyword_searches())
+        try:
+            query_vectors = await self._run_in_executor(self.embed_queries, questions)
+            user_results, common_results, (user_keyword, common_keyword) = await asyncio.gather(
+                self._search_with_timeout("User collection batch", self._search_user_batch, user_id, query_vectors,
+                                          candidates, timeout=Config.USER_SEARCH_TIMEOUT),
+                self._search_common_with_timeout("Common collection batch", self._search_common_batch, query_vectors,
+                                                 candidates, timeout=Config.COMMON_SEARCH_TIMEOUT),
+                keyword_task
+            )
+        finally:
+            keyword_task.cancel()
+        # A search that timed out or was skipped returns [], i.e. no results for any question
+        user_results, common_results = user_results or no_results, common_results or no_results
+        user_keyword, common_keyword = user_keyword or no_results, common_keyword or no_results
+        semaphore = asyncio.Semaphore(Config.BATCH_LLM_CONCURRENCY)
+
+        async def answer(index: int) -> Dict[str, Any]:
+            question = questions[index]
+            try:
+                documents = self._merge_results(
+                    [user_results[index], common_results[index], user_keyword[index], common_keyword[index]], k)
+                if not documents:
+                    return {"index": index, "question": question, "answer": "Nothing relevant found.",
+                            "sources": [], "llm_used": "none"}
+                cached, key_parts = self._cache_lookup(user_id, question, documents, query_vectors[index])
+                if cached is None:
+                    prompt, sources = self._build_prompt(question, documents)
+                    async with semaphore:
+                        answer_text, llm_name = await self.llm_manager.ainvoke_hedged(prompt)
+                    cached = {"answer": answer_text, "sources": sources, "llm_used": llm_name}
+                    self._cache_store(key_parts, cached)
+                return {"index": index, "question": question, **cached}
+            except Exception as e:
+                logger.error(f"Error answering batch question {index}: {e}")
+                return {"index": index, "question": question, "error": str(e)}
+
+        tasks = [asyncio.create_task(answer(index)) for index in range(len(questions))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
 
     def getAnswer(self, user_id: str, question: str, k: int = 4) -> Dict[str, Any]:
         try:
@@ -138,18 +708,18 @@ Answer:"""
         vector_store = self._get_vector_store(user_id)
         return vector_store._collection.count() > 0
 
+    def _ensure_manifest(self, user_id: str):
+        """Backfill a user's source manifest once from their collection if it predates the manifest"""
+        if self.manifest.is_tracked(user_id):
+            return
+        vector_store = self._get_vector_store(user_id)
+        results = vector_store._collection.get(include=['metadatas'])
+        self.manifest.rebuild(user_id, results['metadatas'] or [])
+
     def get_user_documents(self, user_id: str) -> List[Dict]:
         try:
-            vector_store = self._get_vector_store(user_id)
-            results = vector_store._collection.get(include=['metadatas'])
-            documents = {}
-            for metadata in results['metadatas']:
-                source = metadata.get('source', 'Unknown')
-                if source not in documents:
-                    documents[source] = {'source': source, 'chunks': 1, 'processed': True}
-                else:
-                    documents[source]['chunks'] += 1
-            return list(documents.values())
+            self._ensure_manifest(user_id)
+            return self.manifest.list_sources(user_id)
         except Exception as e:
             logger.error(f"Error retrieving documents: {e}")
             return []
@@ -157,10 +727,13 @@ Answer:"""
     def clear_documents(self, user_id: str):
         try:
             vector_store = self._get_vector_store(user_id)
-            results = vector_store._collection.get()
+            results = vector_store._collection.get(include=[])
             ids = results['ids']
             if ids:
                 vector_store._collection.delete(ids=ids)
+            self.manifest.clear(user_id)
+            self.keyword_index.drop(self._user_collection_name(user_id))
+            self.answer_cache.invalidate_scope(f"user:{user_id}")
             logger.info(f"Cleared all documents for user {user_id}")
         except Exception as e:
             logger.error(f"Error clearing documents: {e}")
@@ -182,14 +755,10 @@ Answer:"""
         
     def get_document_count(self, userId: str) -> int:
         try:
-            vectorStore = self._get_vector_store(userId)
-            results = vectorStore._collection.get(include=['metadatas'])
-            if not results['metadatas']:
-                logger.info(f"No metadata found for user {userId}")
-                return 0
-            sources = {metadata.get('source', '') for metadata in results['metadatas'] if metadata.get('source')}
-            logger.info(f"User {userId} has {len(sources)} unique documents")
-            return len(sources)
+            self._ensure_manifest(userId)
+            count = self.manifest.count_sources(userId)
+            logger.debug(f"User {userId} has {count} unique documents")
+            return count
         except Exception as e:
             logger.error(f"Error counting documents for user {userId}: {e}")
             return 0
\ No newline at end of file
@@ -5,6 +5,7 @@ Startup script for the RAG LLM Backend
 
 import sys
 import os
+import time
 import logging
 from pathlib import Path
 
@@ -29,9 +30,11 @@ def main():
         # Import and start the application
         from config import Config
         import uvicorn
+        import_started = time.perf_counter()
         from main import app
         
         print(f"✅ Configuration validated")
+        print(f"⏱️  Imported app in {time.perf_counter() - import_started:.2f}s (services warm up in the background)")
         print(f"🌐 Starting server on {Config.HOST}:{Config.PORT}")
         print(f"📚 Vector database: {Config.CHROMA_DB_PATH}")
         print(f"📁 Upload directory: {Config.UPLOAD_DIR}")
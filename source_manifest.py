@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SourceManifest:
+    """Per-user manifest of ingested sources so counting and listing never scan a collection"""
+
+    def __init__(self, db_path: str):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    user_id TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    chunks INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    ingested_at REAL NOT NULL,
+                    file_hash TEXT,
+                    PRIMARY KEY (user_id, source)
+                )
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sources)")}
+            if 'file_hash' not in columns:
+                self._conn.execute("ALTER TABLE sources ADD COLUMN file_hash TEXT")
+            # Users whose manifest rows are authoritative for their collection
+            self._conn.execute("CREATE TABLE IF NOT EXISTS tracked_users (user_id TEXT PRIMARY KEY)")
+        logger.info(f"SourceManifest opened at {db_path}")
+
+    def is_tracked(self, user_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM tracked_users WHERE user_id = ?", (user_id,)).fetchone()
+            return row is not None
+
+    def get_file_hash(self, user_id: str, source: str) -> Optional[str]:
+        """Get the content hash of the file currently stored under a source name"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_hash FROM sources WHERE user_id = ? AND source = ?", (user_id, source)
+            ).fetchone()
+            return row[0] if row else None
+
+    def record_source(self, user_id: str, source: str, chunks: int, size: int,
+                      file_hash: Optional[str] = None, replace: bool = True):
+        """Record a stored source; replace sets its chunk count, otherwise chunks are added to it"""
+        chunks_update = "excluded.chunks" if replace else "chunks + excluded.chunks"
+        with self._lock, self._conn:
+            self._conn.execute(f"""
+                INSERT INTO sources (user_id, source, chunks, bytes, ingested_at, file_hash) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, source) DO UPDATE SET
+                    chunks = {chunks_update},
+                    bytes = excluded.bytes,
+                    ingested_at = excluded.ingested_at,
+                    file_hash = excluded.file_hash
+            """, (user_id, source, chunks, size, time.time(), file_hash))
+
+    def rebuild(self, user_id: str, metadatas: List[Dict]):
+        """Replace the user's manifest from a one-off scan of their collection metadata"""
+        summary: Dict[str, Dict[str, Any]] = {}
+        for metadata in metadatas:
+            source = metadata.get('source', 'Unknown')
+            entry = summary.setdefault(source, {'chunks': 0, 'bytes': 0, 'file_hash': None})
+            entry['chunks'] += 1
+            entry['bytes'] = int(metadata.get('file_size') or entry['bytes'])
+            entry['file_hash'] = metadata.get('file_hash') or entry['file_hash']
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sources WHERE user_id = ?", (user_id,))
+            self._conn.executemany(
+                "INSERT INTO sources (user_id, source, chunks, bytes, ingested_at, file_hash) VALUES (?, ?, ?, ?, ?, ?)",
+                [(user_id, source, entry['chunks'], entry['bytes'], now, entry['file_hash'])
+                 for source, entry in summary.items()]
+            )
+            self._conn.execute("INSERT OR IGNORE INTO tracked_users (user_id) VALUES (?)", (user_id,))
+        logger.info(f"Rebuilt source manifest for user {user_id}: {len(summary)} sources")
+
+    def clear(self, user_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sources WHERE user_id = ?", (user_id,))
+            self._conn.execute("INSERT OR IGNORE INTO tracked_users (user_id) VALUES (?)", (user_id,))
+
+    def count_sources(self, user_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM sources WHERE user_id = ?", (user_id,)).fetchone()
+            return row[0]
+
+    def list_sources(self, user_id: str) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, chunks, bytes, ingested_at FROM sources WHERE user_id = ? ORDER BY ingested_at, source",
+                (user_id,)
+            ).fetchall()
+        return [
+            {'source': source, 'chunks': chunks, 'bytes': size, 'ingested_at': ingested_at, 'processed': True}
+            for source, chunks, size, ingested_at in rows
+        ]
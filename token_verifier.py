@@ -0,0 +1,166 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import urllib.request
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Any, Optional
+import logging
+
+from firebase_admin import auth
+from google.auth import jwt
+
+from metrics import AUTH_VERIFY_SECONDS, record_timing
+
+if TYPE_CHECKING:
+    from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+
+class TokenVerifier:
+    """Verifies Firebase ID tokens, caching verified claims until each token's exp
+
+    Google's public signing certificates are prefetched and refreshed on a background thread,
+    so a cache miss is a local signature check rather than a network round trip. If the
+    certificates are unavailable or a token is signed with an unknown key, verification falls
+    back to firebase_admin. Cache misses are verified off the event loop.
+    """
+
+    def __init__(self, project_id: str, max_entries: int = 10000, refresh_interval: float = 3600,
+                 clock_skew: int = 10):
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self.clock_skew = clock_skew
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._certs: Dict[str, str] = {}
+        self._certs_fetched_at = 0.0
+        self._certs_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        # Key by digest so raw bearer tokens are never held in memory longer than the request
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def start(self):
+        """Fetch signing certificates now in the background and keep them fresh"""
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="firebase-certs", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                max_age = self.refresh_certs()
+                delay = min(self.refresh_interval, max(max_age - 60, 60))
+            except Exception as e:
+                logger.warning(f"Failed to refresh Firebase signing certificates: {e}")
+                delay = 60
+            time.sleep(delay)
+
+    def refresh_certs(self) -> float:
+        """Download the current signing certificates; returns their Cache-Control max-age"""
+        with urllib.request.urlopen(FIREBASE_CERTS_URL, timeout=10) as response:
+            certs = json.loads(response.read())
+            match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        with self._certs_lock:
+            self._certs = certs
+            self._certs_fetched_at = time.monotonic()
+        logger.debug(f"Refreshed {len(certs)} Firebase signing certificates")
+        return float(match.group(1)) if match else self.refresh_interval
+
+    def _cached(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, claims = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def _store(self, token: str, claims: Dict[str, Any]):
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (float(claims["exp"]), claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _verify_locally(self, token: str) -> Optional[Dict[str, Any]]:
+        """Check the token against the prefetched certificates, or None if they can't be used"""
+        kid = jwt.decode_header(token).get("kid")
+        with self._certs_lock:
+            certs = self._certs
+            stale = time.monotonic() - self._certs_fetched_at > 60
+        if kid not in certs and stale:
+            # Keys rotated since the last refresh (or never fetched): refresh once, at most every minute
+            try:
+                self.refresh_certs()
+            except Exception as e:
+                logger.warning(f"Failed to refresh Firebase signing certificates: {e}")
+            with self._certs_lock:
+                certs = self._certs
+        if kid not in certs:
+            return None
+
+        claims = jwt.decode(token, certs=certs, audience=self.project_id, clock_skew_in_seconds=self.clock_skew)
+        if claims.get("iss") != self.issuer:
+            raise ValueError(f"Invalid token issuer: {claims.get('iss')}")
+        if not claims.get("sub") or len(claims["sub"]) > 128:
+            raise ValueError("Invalid token subject")
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Verify a token (blocking on a cache miss) and return its decoded claims"""
+        claims = self._cached(token)
+        if claims is None:
+            claims = self._verify_uncached(token)
+        return claims
+
+    async def averify(self, token: str) -> Dict[str, Any]:
+        """Verify a token, answering from the cache on the event loop and verifying misses in a thread"""
+        start = time.perf_counter()
+        claims = self._cached(token)
+        cache = "hit"
+        if claims is None:
+            cache = "miss"
+            claims = await asyncio.get_running_loop().run_in_executor(None, self._verify_uncached, token)
+        elapsed = time.perf_counter() - start
+        AUTH_VERIFY_SECONDS.observe(elapsed, cache=cache)
+        record_timing("auth", elapsed)
+        return claims
+
+    def _verify_uncached(self, token: str) -> Dict[str, Any]:
+        claims = self._verify_locally(token)
+        if claims is None:
+            claims = auth.verify_id_token(token)
+        self._store(token, claims)
+        return claims
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "signing_keys": len(self._certs)
+            }
@@ -0,0 +1,141 @@
+import hashlib
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import logging
+
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Raised when an upload is rejected; carries the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class SpooledUpload:
+    """One uploaded file held in memory, spilling to an anonymous temporary file when large"""
+    filename: str
+    file: tempfile.SpooledTemporaryFile
+    size: int = 0
+    file_hash: str = ""
+    _digest: "hashlib._Hash" = field(default_factory=hashlib.sha256, repr=False)
+
+    def close(self):
+        self.file.close()
+
+
+class _MultipartReceiver:
+    """python-multipart callbacks that route each file part of one field into a SpooledUpload"""
+
+    def __init__(self, field_name: str, max_file_size: int, max_files: int, spool_size: int,
+                 is_allowed: Callable[[str], bool]):
+        self.field_name = field_name
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        self.spool_size = spool_size
+        self.is_allowed = is_allowed
+        self.uploads: List[SpooledUpload] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._current: Optional[SpooledUpload] = None
+
+    def callbacks(self) -> Dict[str, Callable]:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._current = None
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name", b"").decode("utf-8", "replace") != self.field_name or b"filename" not in options:
+            return  # Other form fields are ignored
+        filename = Path(options[b"filename"].decode("utf-8", "replace")).name
+        if not self.is_allowed(filename):
+            raise UploadError(400, f"Unsupported file type: {filename}")
+        if len(self.uploads) >= self.max_files:
+            raise UploadError(413, f"At most {self.max_files} files per upload")
+        self._current = SpooledUpload(filename=filename,
+                                      file=tempfile.SpooledTemporaryFile(max_size=self.spool_size))
+        self.uploads.append(self._current)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        upload = self._current
+        if upload is None:
+            return
+        upload.size += end - start
+        if upload.size > self.max_file_size:
+            raise UploadError(413, f"{upload.filename} exceeds the {self.max_file_size} byte limit")
+        chunk = data[start:end]
+        upload._digest.update(chunk)
+        upload.file.write(chunk)
+
+    def on_part_end(self):
+        upload = self._current
+        if upload is not None:
+            upload.file_hash = upload._digest.hexdigest()
+            upload.file.seek(0)
+        self._current = None
+
+
+async def receive_uploads(request: Request, field_name: str, max_file_size: int, max_files: int,
+                          spool_size: int, is_allowed: Callable[[str], bool]) -> List[SpooledUpload]:
+    """Stream a multipart request body into spooled files, enforcing limits as bytes arrive
+
+    Each file is hashed while it is received, so nothing needs to re-read it before parsing.
+    On any error, every file received so far is closed.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError(400, "Expected a multipart/form-data upload")
+    content_length = request.headers.get("content-length")
+    # Reject requests that can't fit before reading any of the body (64KB allows for part headers)
+    if content_length and content_length.isdigit() and int(content_length) > max_file_size * max_files + 65536:
+        raise UploadError(413, f"Upload exceeds {max_files} files of {max_file_size} bytes")
+
+    receiver = _MultipartReceiver(field_name, max_file_size, max_files, spool_size, is_allowed)
+    parser = MultipartParser(options[b"boundary"], receiver.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except Exception:
+        for upload in receiver.uploads:
+            upload.close()
+        raise
+    logger.info(f"Received {len(receiver.uploads)} files "
+                f"({sum(upload.size for upload in receiver.uploads)} bytes)")
+    return receiver.uploads
@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Any
+import logging
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+COMMON_COLLECTION_NAME = "common_knowledge"
+
+
+class VectorStoreRegistry:
+    """Shares long-lived Chroma collection handles on a single persistent client"""
+
+    def __init__(self, embeddings: Embeddings, persist_directory: str, max_user_stores: int = 256):
+        self.embeddings = embeddings
+        self.persist_directory = persist_directory
+        self.max_user_stores = max_user_stores
+        self._client = chromadb.PersistentClient(path=persist_directory)
+        self._lock = threading.Lock()
+        self._user_stores: "OrderedDict[str, Chroma]" = OrderedDict()
+        self._common_store = self._create_store(COMMON_COLLECTION_NAME)
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        logger.info(f"VectorStoreRegistry initialized on {persist_directory} (max {max_user_stores} user stores)")
+
+    def _create_store(self, collection_name: str) -> Chroma:
+        return Chroma(
+            client=self._client,
+            collection_name=collection_name,
+            embedding_function=self.embeddings
+        )
+
+    def get_user_store(self, user_id: str) -> Chroma:
+        """Get the handle for a user's collection, creating it on first use"""
+        collection_name = f"user_{user_id}"
+        with self._lock:
+            store = self._user_stores.get(collection_name)
+            if store is not None:
+                self._user_stores.move_to_end(collection_name)
+                self._hits += 1
+                return store
+
+            self._misses += 1
+            store = self._create_store(collection_name)
+            self._user_stores[collection_name] = store
+            if len(self._user_stores) > self.max_user_stores:
+                evicted, _ = self._user_stores.popitem(last=False)
+                self._evictions += 1
+                logger.debug(f"Evicted vector store handle for {evicted}")
+            return store
+
+    def get_common_store(self) -> Chroma:
+        """Get the pinned handle for the shared common_knowledge collection"""
+        return self._common_store
+
+    def stats(self) -> Dict[str, Any]:
+        """Get handle cache statistics"""
+        with self._lock:
+            return {
+                "user_stores": len(self._user_stores),
+                "max_user_stores": self.max_user_stores,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }